@@ -3,10 +3,13 @@ MAIN CLI INTERFACE
 """
 
 import click
-from .local import DotConfigFiles
-from .gen import patcher
-from .auth import interpret_authentication_params
+from .local import DotConfigFiles, sync_many as sync_homes
+from .gen import patcher, scan
+from .auth import interpret_authentication_params, set_auth_cache
 from .repo import Repository
+from .watch import watch as watch_files
+from . import trace
+import atexit
 import os
 
 local_dir = ""
@@ -19,20 +22,92 @@ no_interactive = None
 @click.option('-u', '--username', 'user', default=None, type=str)
 @click.option('--local', default=None, type=click.Path(writable=True), help="override default db directory, to create localized instances")
 @click.option('--interactive/--no-interactive', default=True, help="no interactive auth")
-def cli(passw, user, interactive, local):
+@click.option('--profile', is_flag=True, default=False, help="print a timing summary of each phase on exit")
+@click.option('--trace-file', default=None, type=click.Path(dir_okay=False, writable=True), help="write a trace of each phase to this file")
+@click.option('--trace-format', default="json", type=click.Choice(["json", "chrome"]), help="format of --trace-file")
+def cli(passw, user, interactive, local, profile, trace_file, trace_format):
     global local_dir, password, username, no_interactive
     password, username, no_interactive, local_dir = passw, user, not interactive, local
     if local_dir is None:
         local_dir = "~"
+    set_auth_cache(os.path.join(os.path.expanduser(local_dir), ".configfiles", "auth.json"))
+    if profile or trace_file:
+        trace.enable()
+        atexit.register(finish_trace, profile, trace_file, trace_format)
+
+def finish_trace(profile, trace_file, trace_format):
+    if trace_file:
+        trace.write_trace(trace_file, trace_format)
+    if profile:
+        click.echo("{:<32} {:>6} {:>10}".format("phase", "calls", "seconds"), err=True)
+        for name, calls, total in trace.summary():
+            click.echo("{:<32} {:>6} {:>10.3f}".format(name, calls, total), err=True)
+        for name, value in sorted(trace.counters.items()):
+            click.echo("{:<32} {:>17}".format(name, value), err=True)
 
 @cli.command()
 @click.argument('remote', required=False, default=None)
 @click.option('--ff/--no-ff', default=True, help="allow fastforwarding")
 @click.option('-c', '--count', required=False, default=-1, type=int, help="amount of times to sync, -1 to latest")
-def sync(remote, ff, count):
+@click.option('-j', '--jobs', default=1, type=int, help="run up to this many scripts that modify disjoint files at once")
+@click.option('--snapshot/--no-snapshot', 'use_snapshot', default=True, help="bootstrap fresh syncs from the latest snapshot")
+@click.option('--replay-custom', is_flag=True, default=False, help="run scripts that modify no files skipped by a snapshot")
+@click.option('--only', multiple=True, type=str, help="only sync scripts modifying files matching this glob (remembered)")
+@click.option('--full', is_flag=True, default=False, help="clear the --only profile, replaying skipped scripts")
+@click.option('--mirror', 'mirrors', multiple=True, type=str, help="read from this mirror, nearest first (remembered)")
+@click.option('--no-mirrors', is_flag=True, default=False, help="forget the mirrors and read from the remote")
+def sync(remote, ff, count, jobs, use_snapshot, replay_custom, only, full, mirrors, no_mirrors):
     interpret_authentication_params(remote, username, password, no_interactive)
     db = DotConfigFiles(load_file=os.path.join(local_dir, ".configfiles"), remote=remote)
-    db.sync(fastforward=ff, remote=remote, maxiter=count)
+    if full:
+        only = []
+    elif not only:
+        only = None
+    if no_mirrors:
+        mirrors = []
+    elif not mirrors:
+        mirrors = None
+    db.sync(fastforward=ff, remote=remote, maxiter=count, jobs=jobs, use_snapshot=use_snapshot, replay_custom=replay_custom, only=only, mirrors=mirrors)
+    db.close()
+
+@cli.command("sync-many")
+@click.argument("homes", nargs=-1, required=True, type=click.Path(file_okay=False))
+@click.option('-r', '--remote', required=True, type=str, help="remote every home is synced to")
+@click.option('-p', '--parallel', default=4, type=int, help="number of homes to sync at once")
+@click.option('-j', '--jobs', default=1, type=int, help="run up to this many scripts that modify disjoint files at once, per home")
+def sync_many(homes, remote, parallel, jobs):
+    interpret_authentication_params(remote, username, password, no_interactive)
+    results = sync_homes(homes, remote, parallel=parallel, jobs=jobs)
+
+    failed = [home for home, error in results.items() if error is not None]
+    click.echo("synced {} of {} homes".format(len(results) - len(failed), len(results)))
+    if failed:
+        raise click.ClickException("failed to sync: " + ", ".join(failed))
+
+@cli.command()
+@click.argument("mirrors", nargs=-1, required=True)
+@click.option("--check", is_flag=True, default=False, help="only report which mirrors are stale")
+def mirror(mirrors, check):
+    interpret_authentication_params(None, username, password, no_interactive)
+    db = DotConfigFiles(load_file=os.path.join(local_dir, ".configfiles"))
+    db.repo.update()
+
+    for url in mirrors:
+        if check:
+            replica = Repository(url, read_only=True)
+            replica.update()
+            state = "up to date" if replica.get_revision() >= db.repo.get_revision() else "stale"
+            click.echo("{}: revision {} of {}, {}".format(url, replica.get_revision(), db.repo.get_revision(), state))
+            replica.close()
+        else:
+            click.echo("pushed revision {} to {}".format(db.repo.mirror(url), url))
+    db.close()
+
+@cli.command()
+def snapshot():
+    interpret_authentication_params(None, username, password, no_interactive)
+    db = DotConfigFiles(load_file=os.path.join(local_dir, ".configfiles"))
+    db.snapshot()
     db.close()
 
 @cli.command()
@@ -42,6 +117,31 @@ def desync():
     db.desync()
     db.close()
 
+@cli.command()
+def repack():
+    db = DotConfigFiles(load_file=os.path.join(local_dir, ".configfiles"))
+    versions, before, after = db.filemon.repack()
+    click.echo("packed {} versions, {} bytes -> {} bytes".format(versions, before, after))
+    db.close()
+
+@cli.command()
+@click.option("-c", "--count", default=10, type=int, help="number of scripts to show, -1 for all")
+def log(count):
+    interpret_authentication_params(None, username, password, no_interactive)
+    db = DotConfigFiles(load_file=os.path.join(local_dir, ".configfiles"))
+    db.repo.update()
+
+    at = db.get_at()
+    end = db.repo.index["end"]
+    start = "" if count == -1 else db.repo.seek(end, -count)
+    for h in reversed(db.repo.between(start, end)):
+        so = db.repo.get_script(h)
+        click.echo("{} {:>5} {} {} ({})".format("*" if h == at else " ", db.repo.position(h), h[:16], so["name"], ", ".join(so["files"]) or "custom"))
+
+    behind = db.repo.distance(at, end)
+    click.echo("at {}, {} behind".format(at[:16] or "nothing", behind) if behind else "up to date")
+    db.close()
+
 @cli.command()
 @click.option("--apply", default=False, type=bool, help="run the script now")
 @click.option("-n", "--name", default=None, type=str, help="script user name")
@@ -72,9 +172,16 @@ def add(script, updates, apply, name):
     db.close()
 
 @cli.command()
-@click.argument("names", type=click.Path(exists=True, dir_okay=False), nargs=-1, required=True)
+@click.argument("names", type=click.Path(exists=True, dir_okay=False), nargs=-1)
 @click.option("-n", "--name", default=None, type=str, help="script user name")
-def update(names, name):
+@click.option("-r", "--recursive", "trees", multiple=True, type=click.Path(exists=True, file_okay=False), help="add new and changed files under this directory")
+@click.option("--include", multiple=True, type=str, help="with -r, only consider files matching this glob")
+@click.option("--exclude", multiple=True, type=str, help="with -r, ignore files and directories matching this glob")
+@click.option("-j", "--jobs", default=os.cpu_count() or 1, type=int, help="number of processes to diff files in")
+def update(names, name, trees, include, exclude, jobs):
+    if not names and not trees:
+        raise click.UsageError("give files or -r directories to update")
+
     interpret_authentication_params(None, username, password, no_interactive)
     db = DotConfigFiles(load_file=os.path.join(local_dir, ".configfiles"))
 
@@ -91,35 +198,52 @@ def update(names, name):
         else:
             writes.append(rel)
 
-    if writes:
-        if name is None:
-            wname = "create {0}".format(", ".join(writes))
-        else:
-            wname = name
+    for tree in trees:
+        new, changed = scan.scan(db, tree, include, exclude)
+        writes.extend(x for x in new if x not in writes)
+        patches.extend(x for x in changed if x not in patches)
 
-        script_text = patcher.create_template_write(db, writes)
-        db.append(script_text, wname, writes)
-    if patches:
-        if name is None:
-            wname = "update {0}".format(", ".join(patches))
-        else:
-            wname = name
+    if not writes and not patches:
+        click.echo("nothing changed")
+        db.close()
+        return
 
-        script_text = patcher.create_template_update(db, patches)
-        db.append(script_text, wname, patches)
+    if name is None:
+        parts = []
+        if writes:
+            parts.append("create {0}".format(", ".join(writes)))
+        if patches:
+            parts.append("update {0}".format(", ".join(patches)))
+        name = "; ".join(parts)
 
-    click.echo("created scripts")
+    # filled in as the script is generated, from the same reads of the files
+    post = {}
+    script_text = patcher.stream_template_combined(db, writes, patches, jobs, post)
+    db.append(script_text, name, writes + patches, post=post)
+
+    click.echo("created script")
     db.close()
 
+@cli.command()
+@click.option("-n", "--name", default=None, type=str, help="script user name")
+@click.option("--debounce", default=2.0, type=float, help="seconds without changes before a batch is checked in")
+@click.option("--max-delay", default=30.0, type=float, help="check in a batch after at most this many seconds")
+@click.option("--poll", is_flag=True, default=False, help="stat the files instead of using inotify")
+def watch(name, debounce, max_delay, poll):
+    interpret_authentication_params(None, username, password, no_interactive)
+    db = DotConfigFiles(load_file=os.path.join(local_dir, ".configfiles"))
+    watch_files(db, debounce=debounce, max_delay=max_delay, name=name, polling=poll)
+    db.close()
 
 @cli.command()
 @click.argument("remote", type=str)
-def init(remote):
+@click.option("--compress", is_flag=True, default=False, help="store scripts gzipped (needs clients that support it)")
+def init(remote, compress):
     interpret_authentication_params(remote, username, password, no_interactive)
     
     repo = Repository(remote)
     repo.open()
-    repo.new()
+    repo.new(compress)
     repo.close()
 
     print("create blank configfiles repo at {}".format(remote))
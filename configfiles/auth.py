@@ -3,7 +3,12 @@ Utilities for authentication
 """
 
 import getpass
+import json
+import os
+import threading
+from urllib.parse import urlsplit
 from paramiko.agent import Agent
+from paramiko import ECDSAKey, Ed25519Key, RSAKey
 from paramiko.ssh_exception import AuthenticationException, BadAuthenticationType, ChannelException, SSHException
 
 def interpret_urlish(url: str):
@@ -14,9 +19,15 @@ def interpret_urlish(url: str):
 
     [username@]some.server.with.a.dns.name:some/path/yipee
 
+    Proper urls (scheme://[username@]host[:port]/path) are also accepted, see repo.backends
+
     Returns an array of [username (defaults to logged in user), servername, path]
     """
 
+    if "://" in url:
+        parts = urlsplit(url)
+        return [parts.username or getpass.getuser(), parts.hostname or parts.netloc, parts.path]
+
     if "@" in url and url.index("@") < url.index(":"):
         username, *url = url.split("@")
         url = "".join(url)
@@ -28,20 +39,32 @@ def interpret_urlish(url: str):
 
     return [username, servername, path]
 
-use_public_key  = True  # if true, try to use public key first, if false only try if password fails
-use_password    = True  # if true, use the password, if false don't bother
 use_interactive = True  # if true and all else fails, fallback to interactive mode
 
 guessed_username = ""
 guessed_password = ""
 
+# file remembering which method (and key) worked for each host, tried first on the next connection; see set_auth_cache
+auth_cache_path = None
+
+KEY_FILES = ["id_ed25519", "id_ecdsa", "id_rsa"]
+
+# sshd disconnects after MaxAuthTries (6 by default) failed attempts, so only this many keys are offered, leaving room for the
+# password and interactive auth after them
+MAX_KEY_ATTEMPTS = 3
+
+_agent = None
+_agent_keys = None
+_file_keys = None
+_auth_lock = threading.Lock()
+
 def interpret_authentication_params(urlish, username, password, no_interactive):
     """
     Interpret parameters passed in to guess authentication parameters. Any can be none.
 
     If no method works, fall back to interactive auth
     """
-    global use_password, use_interactive, use_interactive, guessed_username, guessed_password
+    global use_interactive, guessed_username, guessed_password
 
     if urlish and not username:
         guessed_username, *_ = interpret_urlish(urlish)
@@ -51,64 +74,138 @@ def interpret_authentication_params(urlish, username, password, no_interactive):
         guessed_username = getpass.getuser()
 
     if password:
-        use_public_key = False
         guessed_password = password
-    else:
-        use_password = False
 
     if no_interactive:
         use_interactive = False
 
+def set_auth_cache(path):
+    global auth_cache_path
+    auth_cache_path = path
 
-def authenticate_transport(transport):
+def load_auth_cache():
     """
-    Authenticate the transport with the current authentication parameters.
-
-    Raises AuthenticationException if the authentication failed
+    {"user@host:port": {"method": method, "fingerprint": key fingerprint or ""}}
     """
-    global use_public_key, use_password, use_interactive, guessed_password
-
-    if use_password and not use_public_key:
-        try:
-            transport.auth_password(guessed_username, guessed_password)
-        except ( BadAuthenticationType, AuthenticationException ):
-            use_password = False
-
-    if transport.is_authenticated():
+    if auth_cache_path is None or not os.path.exists(auth_cache_path):
+        return {}
+    try:
+        with open(auth_cache_path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def remember_auth(host, method, fingerprint):
+    if auth_cache_path is None:
         return
-
-    if use_public_key or not use_password:
-        agent = Agent()
-        keys = agent.get_keys()
-        if keys:
-            key = keys[0]
-
+    with _auth_lock:
+        cache = load_auth_cache()
+        cache[host] = {"method": method, "fingerprint": fingerprint}
+        os.makedirs(os.path.dirname(auth_cache_path), exist_ok=True)
+        with open(auth_cache_path + ".tmp", "w") as f:
+            json.dump(cache, f)
+        os.replace(auth_cache_path + ".tmp", auth_cache_path)
+
+def agent_keys():
+    """
+    The keys in the ssh agent, asked for once per process
+    """
+    global _agent, _agent_keys
+    with _auth_lock:
+        if _agent_keys is None:
             try:
-                transport.auth_publickey(guessed_username, key)
-            except ( BadAuthenticationType, AuthenticationException ):
-                use_public_key = False
-            finally:
-                agent.close()
-        else:
-            use_public_key = False
-            agent.close()
- 
-    if transport.is_authenticated():
-        return
+                _agent = Agent()
+                _agent_keys = list(_agent.get_keys())
+            except SSHException:
+                _agent_keys = []
+        return _agent_keys
+
+def file_keys():
+    """
+    The unencrypted default key files in ~/.ssh, loaded once per process
+    """
+    global _file_keys
+    with _auth_lock:
+        if _file_keys is None:
+            _file_keys = []
+            for name in KEY_FILES:
+                path = os.path.expanduser(os.path.join("~", ".ssh", name))
+                if not os.path.exists(path):
+                    continue
+                for cls in (Ed25519Key, ECDSAKey, RSAKey):
+                    try:
+                        _file_keys.append(cls.from_private_key_file(path))
+                        break
+                    except (SSHException, IOError, ValueError):
+                        # wrong key type, or encrypted
+                        continue
+        return _file_keys
+
+def _interactive(transport):
+    global guessed_password
+
+    def interactive_handler(title, instruct, prompts):
+        return [input(x) if y else getpass.getpass(x) for x, y in prompts]
+
+    try:
+        transport.auth_interactive(guessed_username, interactive_handler)
+    except BadAuthenticationType:
+        guessed_password = getpass.getpass("Password for remote: ")
+        transport.auth_password(guessed_username, guessed_password)
+
+def plan_authentication(host):
+    """
+    List the ways to authenticate to host as (method, key fingerprint or "", attempt(transport)), in the order to try them: whatever
+    worked for host last time, then the password (if given), the agent keys and key files and finally interactive auth.
 
+    Keys are tried once each (the default key files are usually in the agent too), and at most MAX_KEY_ATTEMPTS of them besides the
+    one that worked last time, so the server does not disconnect before the password and interactive auth get a turn.
+    """
+    cached = load_auth_cache().get(guessed_username + "@" + host)
+
+    def worked_last_time(step):
+        # a key is the same key whether it came from the agent or its file
+        if cached is None:
+            return False
+        return step[1] == cached["fingerprint"] if cached["fingerprint"] else step[0] == cached["method"]
+
+    keys = []
+    seen = set()
+    for method, candidates in (("agent", agent_keys()), ("keyfile", file_keys())):
+        for key in candidates:
+            fingerprint = key.get_fingerprint().hex()
+            if fingerprint not in seen:
+                seen.add(fingerprint)
+                keys.append((method, fingerprint, lambda t, key=key: t.auth_publickey(guessed_username, key)))
+    # the key that worked last time does not count towards the limit
+    keys.sort(key=lambda x: not worked_last_time(x))
+    del keys[MAX_KEY_ATTEMPTS + (1 if keys and worked_last_time(keys[0]) else 0):]
+
+    plan = []
+    if guessed_password:
+        plan.append(("password", "", lambda t: t.auth_password(guessed_username, guessed_password)))
+    plan.extend(keys)
     if use_interactive:
-        def interactive_handler(title, instruct, prompts):
-            return [input(x) if y else getpass.getpass(x) for x, y in prompts]
+        plan.append(("interactive", "", _interactive))
+
+    plan.sort(key=lambda x: not worked_last_time(x))
+    return plan
+
+def authenticate_transport(transport, host=""):
+    """
+    Authenticate the transport with the current authentication parameters, trying the method that worked for host last time first.
 
+    Raises AuthenticationException if the authentication failed
+    """
+    for method, fingerprint, attempt in plan_authentication(host):
         try:
-            transport.auth_interactive(guessed_username, interactive_handler)
-        except BadAuthenticationType:
-            guessed_password = getpass.getpass("Password for remote: ")
-            transport.auth_password(guessed_username, guessed_password)
-            use_password = True
-            use_public_key = False
-    
-    if transport.is_authenticated():
-        return
+            attempt(transport)
+        except SSHException:
+            continue
+
+        if transport.is_authenticated():
+            if load_auth_cache().get(guessed_username + "@" + host) != {"method": method, "fingerprint": fingerprint}:
+                remember_auth(guessed_username + "@" + host, method, fingerprint)
+            return
 
     raise AuthenticationException("could not authenticate with any of the methods")
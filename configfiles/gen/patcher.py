@@ -3,37 +3,53 @@ Generates update scripts to patch files
 """
 
 from diff_match_patch import diff_match_patch
+import codecs
 import os.path
 import os
+from hashlib import sha256
+from concurrent.futures import ProcessPoolExecutor
 from ..local import DotConfigFiles
 
 diff_match_patch = diff_match_patch()
 
+CHUNK_SIZE = 65536
+
 TEMPLATE = """
 # GENERATED BY PATCHER.py
-# Patches files {}
+# Patches files {files}
 from diff_match_patch import diff_match_patch
+import hashlib
 diff_match_patch = diff_match_patch()
 
-patches = {}
-
-for f in patches:
-    with open(f[0], "r") as re:
-        text = re.read()
-    text, results = diff_match_patch.patch_apply(diff_match_patch.patch_fromText(f[1]), text)
-    if not all(results):
-        raise ValueError('''file differs to much from original''')
-    with open(f[0], "w") as wi:
+# (file, sha256 of original, sha256 of result, delta against original, patch)
+patches = {patches}
+
+for f, pre, post, delta, patch in patches:
+    with open(f, "rb") as re:
+        data = re.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == post:
+        print("Already up to date " + f)
+        continue
+    text = data.decode("utf-8")
+    if digest == pre:
+        # exactly the original, so the delta can be spliced in directly
+        text = diff_match_patch.diff_text2(diff_match_patch.diff_fromDelta(text, delta))
+    else:
+        text, results = diff_match_patch.patch_apply(diff_match_patch.patch_fromText(patch), text)
+        if not all(results):
+            raise ValueError('''file differs to much from original''')
+    with open(f, "w") as wi:
         wi.write(text)
-    print("Updated " + f[0])
+    print("Updated " + f)
 """
 
 TEMPLATE_WRITE = """
 # GENERATED BY PATCHER.py
-# Creates files {}
+# Creates files {files}
 import os
 
-files = {}
+files = {contents}
 
 for f, c in files:
     if not os.path.exists(os.path.dirname(f)) and os.path.dirname(f) != "":
@@ -44,45 +60,139 @@ for f, c in files:
 print("Create files")
 """
 
-def create_template_write(db: DotConfigFiles, file_array):
+def stream_literal(text):
     """
-    Create a write script for files created
+    Yield a string literal for text in pieces of at most CHUNK_SIZE characters, as adjacent literals on separate lines (so it must be
+    placed inside brackets)
+    """
+    if not text:
+        yield "''"
+    for i in range(0, len(text), CHUNK_SIZE):
+        yield repr(text[i:i + CHUNK_SIZE]) + "\n"
+
+def stream_template_write(db: DotConfigFiles, file_array, post=None):
+    """
+    Create a write script for files created, as a stream of pieces. Files are read a chunk at a time.
+
+    :param post: if given, a dict filled with the sha256 of each file as it was read, for the script's post-image hashes
     """
 
     home_dir = os.path.dirname(db.load_file)
-    files = []
+    head, tail = TEMPLATE_WRITE.split("{contents}")
+    yield head.format(files=repr(file_array))
+    yield "[\n"
 
     for f in file_array:
-        p = os.path.join(home_dir, f)
-        with open(p, "r") as g:
-            files.append((f, g.read()))
+        yield "(" + repr(f) + ", (\n"
+        empty = True
+        digest = sha256()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        with open(os.path.join(home_dir, f), "rb") as g:
+            for chunk in iter(lambda: g.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                text = decoder.decode(chunk)
+                if text:
+                    empty = False
+                    yield repr(text) + "\n"
+        decoder.decode(b"", final=True)
+        if post is not None:
+            post[f] = digest.hexdigest()
+        if empty:
+            yield "''\n"
+        yield ")),\n"
+
+    yield "]"
+    yield tail
 
-    files = repr(files)
+def create_template_write(db: DotConfigFiles, file_array):
+    """
+    Create a write script for files created
+    """
 
-    return TEMPLATE_WRITE.format(repr(file_array), files)
+    return "".join(stream_template_write(db, file_array))
 
-def create_template_update(db: DotConfigFiles, file_array):
+def make_patch_entry(f, orig, new):
     """
-    Create a patch script
+    Diff one file for a patch script, from the bytes of its recorded and current versions
+    """
+
+    entry = [f, sha256(orig).hexdigest(), sha256(new).hexdigest(), None, None]
+    orig = orig.decode("utf-8")
+    new  = new.decode("utf-8")
+
+    diffs = diff_match_patch.diff_main(orig, new)
+    diff_match_patch.diff_cleanupSemantic(diffs)
+
+    entry[3] = diff_match_patch.diff_toDelta(diffs)
+    entry[4] = diff_match_patch.patch_make(orig, diffs)
+    entry[4] = diff_match_patch.patch_toText(entry[4])
+    return entry
+
+def stream_template_update(db: DotConfigFiles, file_array, jobs=1, post=None):
+    """
+    Create a patch script, as a stream of pieces. Files are diffed jobs at a time, so only the versions of that many files are in
+    memory at once.
+
+    :param jobs: number of processes to diff files in
+    :param post: if given, a dict filled with the sha256 of each file as it was read, for the script's post-image hashes
     """
 
     home_dir = os.path.dirname(db.load_file)
-    files = []
 
-    for f in file_array:
-        entry = [f, None]
-        with db.filemon.open_version(f, "r") as original, open(os.path.join(home_dir, f), "r") as newer:
-            orig = original.read().decode("utf-8")
-            new  = newer.read()
+    def read_pair(f):
+        with db.filemon.open_version(f, "r") as original, open(os.path.join(home_dir, f), "rb") as newer:
+            return f, original.read(), newer.read()
+
+    def entries():
+        if jobs > 1 and len(file_array) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                for i in range(0, len(file_array), jobs):
+                    pairs = [read_pair(f) for f in file_array[i:i + jobs]]
+                    batch = list(pool.map(make_patch_entry, *zip(*pairs)))
+                    del pairs
+                    yield from batch
+        else:
+            for f in file_array:
+                yield make_patch_entry(*read_pair(f))
+
+    head, tail = TEMPLATE.split("{patches}")
+    yield head.format(files=repr(file_array))
+    yield "[\n"
+    for f, pre, digest, delta, patch in entries():
+        if post is not None:
+            post[f] = digest
+        yield "({!r}, {!r}, {!r}, (\n".format(f, pre, digest)
+        yield from stream_literal(delta)
+        yield "), (\n"
+        yield from stream_literal(patch)
+        yield ")),\n"
+    yield "]"
+    yield tail
+
+def create_template_update(db: DotConfigFiles, file_array, jobs=1):
+    """
+    Create a patch script
 
-            diffs = diff_match_patch.diff_main(orig, new)
-            print(diffs)
-            diff_match_patch.diff_cleanupSemantic(diffs)
+    :param jobs: number of processes to diff files in
+    """
+
+    return "".join(stream_template_update(db, file_array, jobs))
+
+def stream_template_combined(db: DotConfigFiles, writes, patches, jobs=1, post=None):
+    """
+    Create one script that both creates the files in writes and patches the files in patches, as a stream of pieces
 
-            entry[1] = diff_match_patch.patch_make(orig, diffs)
-            entry[1] = diff_match_patch.patch_toText(entry[1])
-        files.append(entry)
+    :param post: if given, a dict filled with the sha256 of each file as it was read, for the script's post-image hashes
+    """
+
+    if writes:
+        yield from stream_template_write(db, writes, post)
+    if patches:
+        yield from stream_template_update(db, patches, jobs, post)
 
-    files = repr(files)
+def create_template_combined(db: DotConfigFiles, writes, patches, jobs=1):
+    """
+    Create one script that both creates the files in writes and patches the files in patches
+    """
 
-    return TEMPLATE.format(repr(file_array), files)
+    return "".join(stream_template_combined(db, writes, patches, jobs))
@@ -0,0 +1,99 @@
+"""
+Finds new and changed files under directory trees, for bulk updates
+"""
+
+import codecs
+import os
+import os.path
+from fnmatch import fnmatch
+import click
+from ..local import DotConfigFiles
+
+CHUNK_SIZE = 65536
+
+def matches(path, include, exclude):
+    """
+    Check a tree-relative path against the include (empty means everything) and exclude globs. Globs are tried against both
+    the whole path and the file name.
+    """
+    def match_any(patterns):
+        return any(fnmatch(path, p) or fnmatch(os.path.basename(path), p) for p in patterns)
+
+    if exclude and match_any(exclude):
+        return False
+    return not include or match_any(include)
+
+def walk(root, include=(), exclude=(), skip=()):
+    """
+    Yield the absolute paths of all files under root matching the globs. Excluded directories, and the directories in skip, are not
+    descended into.
+    """
+    root = os.path.abspath(root)
+    skip = {os.path.abspath(x) for x in skip}
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as it:
+            for entry in it:
+                rel = os.path.relpath(entry.path, root)
+                if entry.is_dir(follow_symlinks=False):
+                    if matches(rel, (), exclude) and entry.path not in skip:
+                        stack.append(entry.path)
+                elif entry.is_file() and matches(rel, include, exclude):
+                    yield entry.path
+
+def is_text(path):
+    """
+    Check that a file can be read and is utf-8 text, which is all generated scripts can hold
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                decoder.decode(chunk)
+        decoder.decode(b"", final=True)
+    except (OSError, UnicodeDecodeError):
+        return False
+    return True
+
+def scan(db: DotConfigFiles, root, include=(), exclude=()):
+    """
+    Find the files under root that are not tracked yet, and the tracked ones that differ from their recorded version.
+
+    A tracked file whose size and mtime match the ones stored when it was last recorded is assumed unchanged without reading it.
+    The instance's own .configfiles folder is never scanned, and unreadable or binary files are skipped with a warning.
+
+    Returns ([new files], [changed files]) as paths relative to the home directory
+    """
+    home_dir = os.path.dirname(db.load_file)
+    new = []
+    changed = []
+
+    # finding recorded versions needs the positions of the scripts in the repo
+    db.repo.update()
+
+    for path in walk(root, include, exclude, skip=[db.load_file]):
+        rel = os.path.relpath(path, start=home_dir)
+        entry = db.index["files"].get(rel)
+        if entry is not None:
+            st = os.stat(path)
+            if entry.get("stat") == [st.st_mtime_ns, st.st_size]:
+                continue
+
+        if not is_text(path):
+            click.echo("skipping {}, it is unreadable or not utf-8 text".format(rel))
+            continue
+        if entry is None:
+            new.append(rel)
+            continue
+
+        with db.filemon.open_version(rel, "rb") as recorded, open(path, "rb") as current:
+            same = recorded.read() == current.read()
+        if same:
+            entry["stat"] = [st.st_mtime_ns, st.st_size]
+        else:
+            changed.append(rel)
+
+    new.sort()
+    changed.sort()
+    return new, changed
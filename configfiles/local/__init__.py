@@ -1 +1,2 @@
 from .db import DotConfigFiles
+from .batch import sync_many
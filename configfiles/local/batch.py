@@ -0,0 +1,101 @@
+"""
+Batch sync:
+
+syncs many configfiles instances (e.g. the homes of lots of service accounts) against the same remote in one process, sharing
+one connection, one copy of the remote index and one cache of downloaded scripts between them.
+"""
+
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import click
+from ..repo import Repository
+from .. import trace
+from .hashes import get_remote_hash
+from .db import DotConfigFiles
+
+class SharedRepository:
+    """
+    Stands in for a Repository in many DotConfigFiles at once.
+
+    The index is fetched once (so every instance syncs to the same revision) and every script is downloaded at most once.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.scripts = {}
+        self.snapshots = {}
+
+    def __getattr__(self, name):
+        return getattr(self.repo, name)
+
+    def __iter__(self):
+        return iter(self.repo)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def update(self):
+        with self.lock:
+            if not self.loaded:
+                self.repo.update()
+                self.loaded = True
+
+    def download_script(self, hname=None):
+        if hname is None:
+            hname = self.repo.index["start"]
+        with self.lock:
+            if hname not in self.scripts:
+                self.scripts[hname] = self.repo.download_script(hname)
+            else:
+                trace.count("script_cache_hits")
+            return self.scripts[hname]
+
+    def download_snapshot(self, hname):
+        with self.lock:
+            if hname not in self.snapshots:
+                self.snapshots[hname] = self.repo.download_snapshot(hname)
+            return self.snapshots[hname]
+
+def sync_many(homes, remote, parallel=4, **kwargs):
+    """
+    Sync the configfiles instances in homes (directories containing a .configfiles) to remote, up to parallel at once.
+
+    kwargs go to DotConfigFiles.sync. A failure in one home does not affect the others.
+
+    Returns {home: None if it synced, otherwise the exception}
+    """
+    shared = SharedRepository(Repository(remote))
+    shared.update()
+
+    def sync_one(home):
+        db = DotConfigFiles(load_file=os.path.join(home, ".configfiles"), remote=remote, repo=shared)
+        try:
+            if db.get_at() != "" and get_remote_hash(db.index["remote"]) != get_remote_hash(remote):
+                raise RuntimeError("synced to a different remote, desync it first")
+            with trace.span("sync_many.home", home=home):
+                if not db.sync(remote=remote, **kwargs):
+                    raise RuntimeError("a script failed, rolled back to " + (db.get_at() or "original"))
+        finally:
+            db.close()
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(parallel, 1)) as pool:
+        futures = {home: pool.submit(sync_one, home) for home in homes}
+        for home, fut in futures.items():
+            try:
+                fut.result()
+                results[home] = None
+            except Exception as e:
+                click.echo("err: {} failed to sync:".format(home), err=True)
+                click.echo(traceback.format_exc(), err=True)
+                results[home] = e
+
+    shared.repo.close()
+    return results
@@ -13,6 +13,9 @@ rhash = urlish 1+2 with trailing / removed
     - at (current script index)
     - files (file tracking information database)
     - remote (remote urlish)
+    - sparse (optional list of globs; if set only scripts modifying matching files are ran)
+    - skipped (scripts skipped because of the sparse profile, "snapshot:(hash)" for partially restored snapshots)
+    - mirrors (optional list of read-only mirror urls that sync reads from instead of remote, nearest first)
 
 files:
 
@@ -26,20 +29,32 @@ files folder:
 
 statename.gz (gzipped file)
 
+or, once repacked, files.idx and files.N.pack holding all of them (see pack.py)
+
 """
 
+import io
 import json
 import os
+import shutil
 import sys
+import tarfile
+from fnmatch import fnmatch
 from ..repo import Repository
-from .hashes import get_remote_hash
+from .hashes import get_remote_hash, get_content_hash
+from .. import trace
 import tempfile
 import subprocess
 import click
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 class DotConfigFiles:
-    def __init__(self, load_file="~/.configfiles", remote=None):
+    def __init__(self, load_file="~/.configfiles", remote=None, repo=None):
+        """
+        :param repo: use this (already constructed, possibly shared) repository instead of creating one
+        """
         self.load_file = os.path.expanduser(load_file)
+        self.shared_repo = repo
         if not os.path.exists(self.load_file) or not os.path.isdir(self.load_file):
             os.makedirs(self.load_file)
         if not os.path.exists(os.path.join(self.load_file, "files")):
@@ -56,15 +71,16 @@ class DotConfigFiles:
         self._try_load(remote)
 
         self.filemon = FileMon(self)
+        self.journal = SyncJournal(os.path.join(self.load_file, "journal"))
 
     def _try_load(self, remote):
         index_path = os.path.join(self.load_file, self.current_remote + ".json")
         if os.path.exists(index_path):
             with open(index_path, "r") as f:
                 self.index = json.load(f)
-            self.repo = Repository(self.index["remote"])
+            self.repo = self.shared_repo or Repository(self.index["remote"])
         else:
-            self.repo = Repository(remote)
+            self.repo = self.shared_repo or Repository(remote)
             self.index = {
                     "revision": -1,
                     "at": "",
@@ -86,9 +102,18 @@ class DotConfigFiles:
         self.repo.close()
         self.write()
 
-    def write(self):
-        with open(os.path.join(self.load_file, self.current_remote + ".json"), "w") as f:
+    def write(self, sync=False):
+        """
+        Write the index. It is written to a temporary file first so an interruption never leaves a half-written index;
+        with sync it is also fsync-ed, which is done at the phase boundaries of a sync.
+        """
+        index_path = os.path.join(self.load_file, self.current_remote + ".json")
+        with open(index_path + ".tmp", "w") as f:
             json.dump(self.index, f)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(index_path + ".tmp", index_path)
 
     def desync(self):
         """
@@ -100,7 +125,9 @@ class DotConfigFiles:
 
         self.index["at"] = ""
         self.index["revision"] = -1
-        self.write()
+        self.index["skipped"] = []
+        self.write(sync=True)
+        self.journal.clear()
 
     def rollback(self, count=1):
         """
@@ -114,11 +141,10 @@ class DotConfigFiles:
         if previous_script == "":
             self.desync() # rolling back to original == desync
             return
-        for i in range(count):
-            previous_script = self.repo.get_script(previous_script)["prev"]
-            if previous_script == "":
-                self.desync() # rolling back to original == desync
-                return
+        previous_script = self.repo.seek(previous_script, -count)
+        if previous_script == "":
+            self.desync() # rolling back to original == desync
+            return
 
         # Restore all files to their state right now.
         for fname in self.index["files"]:
@@ -126,15 +152,71 @@ class DotConfigFiles:
 
         self.index["at"] = previous_script
         self.index["revision"] = -1
-        self.write()
+        self.write(sync=True)
+        self.journal.clear()
 
         click.echo("rolled back to " + previous_script)
 
-    def sync(self, fastforward=True, remote=None, maxiter=-1):
+    def sync(self, fastforward=True, remote=None, maxiter=-1, jobs=1, use_snapshot=True, replay_custom=False, only=None, mirrors=None):
         """
         Syncs the repo
+
+        :param jobs: maximum number of scripts to run at once; scripts only run together if they modify disjoint files
+        :param use_snapshot: when syncing from nothing, start from the latest snapshot in the repo instead of replaying everything
+        :param replay_custom: also run the scripts that modify no files skipped over by the snapshot
+        :param only: set the sparse profile to these globs (an empty list clears it, None keeps the current one). Only scripts
+                     modifying files matching the profile are ran; widening it replays the scripts that were skipped.
+        :param mirrors: set the read-only mirrors to read from, nearest first (an empty list clears them, None keeps the current ones).
+                        Writes (append) always go to the primary remote.
+
+        Returns False if a script failed (and was rolled back), True otherwise
+        """
+
+        if mirrors is not None:
+            self.index["mirrors"] = list(mirrors)
+
+        with trace.span("sync"):
+            # Read from a mirror if there is a usable one (not when switching to another remote)
+            mirror = None
+            if remote is None or get_remote_hash(remote) == self.current_remote:
+                mirror = self._open_mirror()
+            if mirror is not None:
+                primary, self.repo = self.repo, mirror
+
+            try:
+                return self._sync(fastforward, remote, maxiter, jobs, use_snapshot, replay_custom, only)
+            finally:
+                if mirror is not None:
+                    mirror.close()
+                    self.repo = primary
+
+    def _open_mirror(self):
         """
+        Open the first usable read mirror (they are listed nearest first), or return None to read from the primary.
 
+        Mirrors of another repo, or behind the revision this instance is already at (i.e. stale), are skipped.
+        """
+        for url in self.index.get("mirrors", []):
+            mirror = Repository(url, read_only=True)
+            try:
+                mirror.update()
+            except Exception as e:
+                # any failure to reach a mirror just means falling back to the next one
+                click.echo("mirror {} unavailable: {}".format(url, e))
+                mirror.close()
+                continue
+
+            primary = mirror.index.get("mirror", {}).get("primary")
+            if primary is None or get_remote_hash(primary) != get_remote_hash(self.index["remote"]):
+                click.echo("{} is not a mirror of {}, ignoring it".format(url, self.index["remote"]))
+            elif mirror.get_revision() < self.get_revision():
+                click.echo("mirror {} is stale (revision {}, already at {}), ignoring it".format(url, mirror.get_revision(), self.get_revision()))
+            else:
+                return mirror
+            mirror.close()
+        return None
+
+    def _sync(self, fastforward, remote, maxiter, jobs, use_snapshot, replay_custom, only):
         if remote != None and get_remote_hash(remote) != self.current_remote:
             # Do a sanity check; is the repo desynced?
             if self.index["at"] != "":
@@ -146,8 +228,14 @@ class DotConfigFiles:
         else:
             remote = self.index["remote"]
 
+        if only is not None:
+            self.index["sparse"] = list(only)
+            self.write()
+        if not self._replay_skipped(jobs):
+            return False
+
         if self.up_to_date():
-            return
+            return True
 
         if self.repo.index["end"] == "":
             click.echo("nothing in repo, nothing to do")
@@ -156,7 +244,7 @@ class DotConfigFiles:
                 f.write(self.current_remote)
 
             self.write()
-            return
+            return True
 
         # Sync the repo
         self.repo.update()
@@ -165,14 +253,9 @@ class DotConfigFiles:
         if maxiter == -1:
             target = self.repo.index["end"]
         else:
-            target = self.get_at()
-            if target == self.repo.index["end"]:
-                return
-            for i in self.repo.iterate_from(self.repo.get_script(target)["next"]):
-                target = i
-                maxiter -= 1
-                if maxiter <= 0:
-                    break
+            target = self.repo.seek(self.get_at(), maxiter)
+            if target == self.get_at():
+                return True
 
         # First, check if we can fastforward.
         if fastforward:
@@ -188,58 +271,438 @@ class DotConfigFiles:
                 self.index["at"] = target
                 self.write()
 
-                return
-
-        script_path = os.path.join(self.load_file, "script.py")
-        script_path = os.path.abspath(script_path)
+                return True
+
+        # Bootstrap from a snapshot if we are starting from nothing
+        if use_snapshot and self.get_at() == "":
+            snap = self.repo.latest_snapshot(target)
+            if snap and not self._restore_snapshot(snap, replay_custom):
+                return False
+
+        # Collect the scripts between here and the target, in chain order
+        pending = []
+        skipped = []
+        for h in self.repo.between(self.get_at(), target):
+            if self._in_profile(self.repo.get_script(h)["files"]):
+                pending.append((h, self.repo.get_script(h)))
+            elif h not in self.index.setdefault("skipped", []):
+                skipped.append(h)
+        if skipped:
+            click.echo("skipping {} scripts outside the sparse profile".format(len(skipped)))
+            self.index["skipped"].extend(skipped)
+            self.write(sync=True)
 
         # Main loop; while not fully synced (not fastforward)
-        while self.get_at() != target:
-            if self.get_at() != "":
-                next_script = self.repo.get_script(self.get_at())["next"]
-                so = self.repo.get_script(next_script)
+        if not self._run_scripts(pending, jobs):
+            return False
+        self.index["at"] = target
+
+        self.current_remote = get_remote_hash(remote)
+        with open(os.path.join(self.load_file, "current"), "w") as f:
+            f.write(self.current_remote)
+
+        self.index["revision"] = self.repo.get_revision()
+        self.write(sync=True)
+        self.journal.clear()
+        click.echo("synced to " + self.index["remote"])
+        return True
+
+    def snapshot(self):
+        """
+        Store the state of every tracked file at the current script in the repo, so fresh syncs can skip replaying everything before it.
+        """
+        at = self.get_at()
+        if at == "":
+            raise RuntimeError("nothing synced, nothing to snapshot")
+        if self.index.get("sparse") or self.index.get("skipped"):
+            # the snapshot would leave out every file outside the profile
+            raise RuntimeError("this instance is sparse, snapshot from a full one (or sync --full first)")
+
+        self.repo.update()
+        buf = io.BytesIO()
+        files = []
+        deleted = []
+
+        with trace.span("snapshot.pack"), tarfile.open(fileobj=buf, mode="w:gz") as tar:
+            for fname in self.index["files"]:
+                hashname = self.filemon.find_version(fname, at)
+                if hashname is None:
+                    continue
+                elif hashname == "":
+                    deleted.append(fname)
+                    continue
+
+                with self.filemon.open(hashname, "rb") as f:
+                    data = f.read()
+                info = tarfile.TarInfo(fname)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+                files.append(fname)
+
+        self.repo.add_snapshot(at, buf.getvalue(), files, deleted)
+        click.echo("snapshotted {} files at {}".format(len(files), at))
+
+    def _restore_snapshot(self, snap, replay_custom):
+        """
+        Restore the snapshot taken at script snap in bulk, recording originals first, and set at to it.
+
+        Only files in the sparse profile are restored; if any are left out the snapshot is marked as skipped.
+
+        Returns False if one of the replayed custom scripts failed.
+        """
+        info = self.repo.index["snapshots"][snap]
+        newin, custom = self._snapshot_history(snap)
+
+        if custom:
+            click.echo("the snapshot skips {} script(s) that modify no files:".format(len(custom)))
+            for h, so in custom:
+                click.echo("    " + so["name"])
+
+            if replay_custom:
+                with ThreadPoolExecutor(max_workers=1) as pool:
+                    for h, so in custom:
+                        if self._start_script(pool, h, so).result() != 0:
+                            click.echo("err: one of the scripts failed.")
+                            return False
             else:
-                next_script = self.repo.index["start"]
-                so = self.repo.get_script(next_script)
+                click.echo("pass --replay-custom to run them")
 
-            # For each file, check if it needs originalizing
+        click.echo("restoring snapshot at " + snap)
+        files = [x for x in info["files"] + info["deleted"] if self._in_profile([x])]
+        if len(files) < len(info["files"] + info["deleted"]):
+            self.index.setdefault("skipped", []).append("snapshot:" + snap)
+        self._unpack_snapshot(snap, files, newin)
+
+        self.index["at"] = snap
+        self.write(sync=True)
+        return True
+
+    def _snapshot_history(self, snap):
+        """
+        Work out which script each file first appeared in, and which scripts that modify no files are skipped over by a snapshot
+        """
+        newin = {}
+        custom = []
+        for h in self.repo.between("", snap):
+            so = self.repo.get_script(h)
+            if not so["files"]:
+                custom.append((h, so))
             for x in so["files"]:
-                if x not in self.index["files"] or self.index["files"][x]["newin"] == next_script:
-                    # record original
-                    self.filemon.record_original(x, next_script)
+                newin.setdefault(x, h)
+        return newin, custom
 
-            # Apply the script.
-            script_code = self.repo.download_script(next_script)
+    def _unpack_snapshot(self, snap, files, newin):
+        """
+        Restore files from the snapshot taken at script snap, recording their originals first
+        """
+        info = self.repo.index["snapshots"][snap]
+        data = self.repo.download_snapshot(snap)
+
+        with trace.span("snapshot.restore"), tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+            # If a previous restore was interrupted the files on disk are no longer the originals
+            if not reached(self._load_journal().get("snapshot:" + snap), "originals"):
+                for x in files:
+                    addedin = newin.get(x, snap)
+                    if x not in self.index["files"] or self.index["files"][x]["newin"] == addedin:
+                        # record original
+                        self.filemon.record_original(x, addedin)
+                self.filemon.flush()
+                self.write(sync=True)
+                self.journal.log("snapshot:" + snap, "originals")
+
+            for x in files:
+                if x in info["deleted"]:
+                    self.filemon.restore_hash(x, "")
+                    continue
+
+                local_path = os.path.join(os.path.dirname(self.load_file), x)
+                if os.path.dirname(local_path) and not os.path.exists(os.path.dirname(local_path)):
+                    os.makedirs(os.path.dirname(local_path))
+                with tar.extractfile(x) as source, self.filemon.open_local(x, "wb") as sink:
+                    shutil.copyfileobj(source, sink)
+
+            for x in files:
+                self.index["files"][x]["chain"][snap] = self.filemon.snapshot_file(x, snap)
+            self.filemon.flush()
+
+    def _in_profile(self, files):
+        """
+        Check if any of files is selected by the sparse profile (everything is if there is none)
+        """
+        sparse = self.index.get("sparse")
+        if not sparse:
+            return True
+        return any(fnmatch(x, p) for x in files for p in sparse)
+
+    def _replay_skipped(self, jobs):
+        """
+        Replay the scripts (and snapshot files) skipped by earlier sparse syncs that the current profile selects.
+
+        Returns False if one of them failed.
+        """
+        skipped = self.index.get("skipped", [])
+        if not skipped:
+            return True
+
+        self.repo.update()
+        scripts = []
+        for h in list(skipped):
+            if h.startswith("snapshot:"):
+                snap = h[len("snapshot:"):]
+                info = self.repo.index["snapshots"][snap]
+                files = [x for x in info["files"] + info["deleted"] if self._in_profile([x]) and
+                         snap not in self.index["files"].get(x, {}).get("chain", {})]
+                if files:
+                    click.echo("restoring {} files from snapshot at {}".format(len(files), snap))
+                    self._unpack_snapshot(snap, files, self._snapshot_history(snap)[0])
+                if all(self._in_profile([x]) for x in info["files"] + info["deleted"]):
+                    skipped.remove(h)
+            elif self._in_profile(self.repo.get_script(h)["files"]):
+                scripts.append((h, self.repo.get_script(h)))
+
+        if scripts:
+            plan = self._replay_plan(scripts)
+            click.echo("replaying {} previously skipped scripts".format(len(scripts)))
+            if len(plan) > len(scripts):
+                click.echo("and re-running {} later scripts that modify the same files".format(len(plan) - len(scripts)))
+            if not self._run_scripts(plan, jobs, advance_at=False):
+                return False
+            for h, _ in scripts:
+                skipped.remove(h)
+
+        self.write(sync=True)
+        return True
+
+    def _replay_plan(self, scripts):
+        """
+        Work out what to run to replay skipped scripts (list of (hash, script object) in chain order) as if they had never been skipped.
+
+        Scripts already applied after a skipped one may have modified the same files, so they are re-run too (along with the scripts
+        after them modifying files they did), after putting those files back to how they were before the first script re-run on them.
+
+        Returns the scripts to run, in chain order
+        """
+        replay = {h for h, _ in scripts}
+        still_skipped = set(self.index.get("skipped", [])) - replay
+        first = min(self.repo.position(h) for h in replay)
+
+        plan = []
+        files = set()
+        restore = {}
+        for h in self.repo.between(self.repo.at_position(first - 1), self.get_at()):
+            so = self.repo.get_script(h)
+            if h in replay or (h not in still_skipped and files & set(so["files"])):
+                plan.append((h, so))
+                for x in so["files"]:
+                    restore.setdefault(x, h)
+                files |= set(so["files"])
+
+        for x, h in restore.items():
+            if x in self.index["files"]:
+                self._restore_before(x, h, {})
+        return plan
+
+    def _run_scripts(self, scripts, jobs, advance_at=True):
+        """
+        Run scripts (list of (hash, script object) in chain order), running up to jobs of them at once.
+
+        File chains and at (unless advance_at is False, for replaying old scripts) are only ever advanced over the fully
+        completed prefix of scripts, so if a script fails everything past that prefix is undone and False is returned.
+
+        Each script's progress is kept in the journal, so if a previous run was interrupted its scripts resume from the last
+        phase they completed.
+        """
+        jobs = max(jobs, 1)
+        sched = ScriptScheduler(scripts)
+        objs = dict(scripts)
+        outputs = {}
+        running = {}
+        failed = False
+
+        resumed = self._load_journal()
+        resumed = {h: resumed[h] for h in objs if h in resumed}
+
+        # Finish off scripts that had already ran
+        for h in objs:
+            if reached(resumed.get(h), "recorded"):
+                outputs[h] = resumed[h]["files"]
+            elif reached(resumed.get(h), "executed"):
+                outputs[h] = self._record_script(h, objs[h])
+            else:
+                continue
+            click.echo("resuming " + objs[h]["name"])
+            sched.start(h)
+            sched.finish(h)
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while True:
+                for h in sched.advance():
+                    for x, hashname in outputs.pop(h).items():
+                        self.index["files"][x]["chain"][h] = hashname
+                    if advance_at:
+                        self.index["at"] = h
+                    self.write(sync=True)
+
+                if sched.finished():
+                    break
+
+                if not failed:
+                    for h in sched.ready(jobs - len(running)):
+                        running[self._start_script(pool, h, objs[h], resumed.get(h), outputs)] = h
+                        sched.start(h)
+                if not running:
+                    break
+
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in completed:
+                    h = running.pop(fut)
+                    if fut.result() != 0:
+                        failed = True
+                        continue
+
+                    for x in objs[h]["files"]:
+                        self.filemon.flush_local(x)
+                    self.journal.log(h, "executed")
+
+                    outputs[h] = self._record_script(h, objs[h])
+                    sched.finish(h)
+
+        if failed:
+            click.echo("err: one of the scripts failed.")
+            touched = {x for h in sched.uncommitted_started() for x in objs[h]["files"]}
+            for x in touched:
+                self.filemon.restore_latest(x, self.get_at())
+            self.write(sync=True)
+            self.journal.clear()
+            click.echo("rolled back to " + (self.get_at() or "original"))
+            return False
+
+        return True
+
+    def _load_journal(self):
+        """
+        Load the entries of the journal, if it belongs to a sync started from the current state: the same remote, and an at that at
+        has only moved forward from since. Otherwise (e.g. the instance was desynced after an interrupted sync) the journal is
+        discarded and a new one started from the current state.
+        """
+        entries = self.journal.load()
+        base = entries.pop("", None)
+        if base is not None and base.get("remote") == self.current_remote:
+            try:
+                if self.repo.position(base["at"]) <= self.repo.position(self.get_at()):
+                    return entries
+            except KeyError:
+                # at is not a script in the repo (anymore)
+                pass
+
+        self.journal.clear()
+        self.journal.log("", "base", at=self.get_at(), remote=self.current_remote)
+        return {}
+
+    def _record_script(self, h, so):
+        """
+        Record the post-files of a script that ran, returning the {file: hash} to put in the chains
+        """
+        with trace.span("sync.record_files", script=h):
+            recorded = {x: self.filemon.snapshot_file(x, h) for x in so["files"]}
+            self.filemon.flush()
+        self.journal.log(h, "recorded", files=recorded)
+        return recorded
+
+    def _start_script(self, pool, h, so, entry=None, outputs=None):
+        """
+        Prepare a script (record originals, download) and submit it to the pool. The future resolves to the return code.
+
+        entry is the script's journal entry if a previous run was interrupted partway through it.
+        """
+        if not reached(entry, "originals"):
+            # For each file, check if it needs originalizing
+            with trace.span("sync.record_originals", script=h):
+                for x in so["files"]:
+                    if x not in self.index["files"] or self.index["files"][x]["newin"] == h:
+                        # record original
+                        self.filemon.record_original(x, h)
+                self.filemon.flush()
+                self.write(sync=True)
+            self.journal.log(h, "originals")
+        else:
+            # The script may have been interrupted while running, put its files back to how they were before it
+            click.echo("resuming " + so["name"])
+            for x in so["files"]:
+                self._restore_before(x, h, outputs or {})
+
+        if self._already_applied(so):
+            click.echo("already applied " + so["name"])
+            trace.count("scripts_skipped")
+            done = Future()
+            done.set_result(0)
+            return done
+
+        script_path = os.path.abspath(os.path.join(self.load_file, "script_" + h[:16] + ".py"))
+        if not reached(entry, "downloaded") or not os.path.exists(script_path):
+            script_code = self.repo.download_script(h)
             with open(script_path, "w") as f:
                 f.write(script_code.decode("utf-8"))
-            
-            click.echo("running " + so["name"])
-            
-            result = subprocess.run([sys.executable, os.path.relpath(script_path, os.path.dirname(self.load_file))], cwd=os.path.dirname(self.load_file))
-            self.index["at"] = next_script
-            if result.returncode != 0:
-                click.echo("err: one of the scripts failed.")
-                self.rollback()
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal.log(h, "downloaded")
+
+        click.echo("running " + so["name"])
+        return pool.submit(self._execute_script, h, so, script_path)
+
+    def _already_applied(self, so):
+        """
+        Check if every file of a script already matches the post-image hashes it declares, in which case running it is pointless
+        """
+        post = so.get("post")
+        if not post or set(post) != set(so["files"]):
+            return False
+
+        home_dir = os.path.dirname(self.load_file)
+        for x, digest in post.items():
+            path = os.path.join(home_dir, x)
+            if not os.path.isfile(path) or get_content_hash(path) != digest:
+                return False
+        return True
+
+    def _restore_before(self, fname, h, outputs):
+        """
+        Restore fname to its state right before script h, taking into account recorded but not yet committed scripts in outputs
+        """
+        version = self.repo.get_script(h)["prev"]
+        while version and not (version in outputs and fname in outputs[version]):
+            if version in self.index["files"][fname]["chain"]:
+                self.filemon.restore_version(fname, version)
                 return
+            version = self.repo.get_script(version)["prev"]
 
-            # Record post-files
-            for x in so["files"]:
-                self.filemon.record_file(x)
+        if version:
+            self.filemon.restore_hash(fname, outputs[version][fname])
+        else:
+            self.filemon.restore_version(fname, None)
 
-        self.current_remote = get_remote_hash(remote)
-        with open(os.path.join(self.load_file, "current"), "w") as f:
-            f.write(self.current_remote)
+    def _execute_script(self, h, so, script_path):
+        with trace.span("sync.execute", script=h, title=so["name"]):
+            result = subprocess.run([sys.executable, os.path.relpath(script_path, os.path.dirname(self.load_file))], cwd=os.path.dirname(self.load_file))
+        trace.count("scripts_run")
+        os.remove(script_path)
+        return result.returncode
 
-        self.index["revision"] = self.repo.get_revision()
-        self.write()
-        click.echo("synced to " + self.index["remote"])
+    def append(self, script_text, name, files, runnow=False, post=None):
+        """
+        Append a script to the repo
 
-    def append(self, script_text, name, files, runnow=False):
+        :param script_text: the script, as a string or an iterable of string pieces (see Repository.append_script)
+        :param post: optional {file: sha256} of the files after the script runs, letting sync skip it if they already match. It may
+            still be filled in while script_text is streamed.
+        """
         script_obj = {
             "name": name,
             "files": files,
             "next": ""
         }
+        if post is not None:
+            script_obj["post"] = post
 
         self.repo.update()
         self.repo.append_script(script_obj, script_text)
@@ -257,3 +720,5 @@ class DotConfigFiles:
                 self.filemon.record_file(x)
 
 from .filemon import FileMon
+from .sched import ScriptScheduler
+from .journal import SyncJournal, reached
@@ -10,26 +10,85 @@ import os
 import shutil
 from gzip import GzipFile
 from .hashes import get_file_hash
+from .pack import VersionPack, repack
+from .. import trace
 
 class FileMon:
     def __init__(self, db):
         self.db = db  # type: DotConfigFiles
+        self.dirty = []
+
+        # the packed version store, if this instance has been repacked (see pack.py)
+        self.pack = VersionPack(db.load_file) if VersionPack.exists(db.load_file) else None
+
+    def flush(self):
+        """
+        fsync every stored file written since the last flush (and the files/ directory), used at the phase boundaries of a sync
+        """
+        for path in self.dirty:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        if self.dirty:
+            fd = os.open(os.path.join(self.db.load_file, "files"), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.dirty = []
+        if self.pack is not None:
+            self.pack.flush()
+
+    def repack(self):
+        """
+        Move every stored version into the pack, compacting it. Returns (number of versions, bytes before, bytes after)
+        """
+        if self.pack is not None:
+            self.pack.close()
+        result = repack(self.db.load_file)
+        self.pack = VersionPack(self.db.load_file)
+        return result
+
+    def flush_local(self, fname):
+        """
+        fsync a file in the domain, if it exists
+        """
+        final_path = os.path.join(os.path.dirname(self.db.load_file), fname)
+        if os.path.exists(final_path):
+            fd = os.open(final_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
 
     def open(self, fhash, mode="rb"):
         """
         Open a file in the database by its hash
         """
         final_path = os.path.join(self.db.load_file, "files", fhash+".gz")
+        if self.pack is None and "r" in mode and not os.path.exists(final_path) and VersionPack.exists(self.db.load_file):
+            # another process repacked the loose versions since this one started
+            self.pack = VersionPack(self.db.load_file)
+
+        if self.pack is not None and ("w" in mode or fhash in self.pack):
+            return self.pack.open(fhash, mode)
+
+        if "w" in mode or "a" in mode:
+            self.dirty.append(final_path)
         return GzipFile(final_path, mode)
 
     def open_version(self, fname, mode, version=None):
         """
-        Open the latest stored version of a file (override None for custom)
+        Open the latest stored version of a file as of script version (default: at)
         """
         if version is None:
             version = self.db.get_at()
 
-        fhash = self.db.index["files"][fname]["chain"][version]
+        fhash = self.find_version(fname, version)
+        if fhash is None:
+            fhash = self.db.index["files"][fname]["original"]
         return self.open(fhash, mode)
 
     def open_local(self, fname, *args, **kwargs):
@@ -41,18 +100,33 @@ class FileMon:
         final_path = os.path.join(os.path.dirname(self.db.load_file), fname)
         return open(final_path, *args, **kwargs)
 
-    def record_file(self, fname):
+    def snapshot_file(self, fname, version):
         """
-        Record the current content in fname for the current at
+        Store the current content of fname as the version for script version, without touching the index.
+
+        Returns the stored hash ("" if the file does not exist)
         """
-        hashname = get_file_hash(self.db.current_remote, fname, self.db.get_at())
+        hashname = get_file_hash(self.db.current_remote, fname, version)
         if os.path.exists(os.path.join(os.path.dirname(self.db.load_file), fname)):
-            with self.open(hashname, "wb") as sink, self.open_local(fname, "rb") as source:
-                shutil.copyfileobj(source, sink)
-            self.db.index["files"][fname]["chain"][self.db.get_at()] = hashname
+            with trace.span("filemon.record", file=fname):
+                with self.open(hashname, "wb") as sink, self.open_local(fname, "rb") as source:
+                    shutil.copyfileobj(source, sink)
+                    trace.count("bytes_local_written", source.tell())
+            return hashname
         else:
-            self.db.index["files"][fname]["chain"][self.db.get_at()] = ""
+            return ""
+
+    def record_file(self, fname):
+        """
+        Record the current content in fname for the current at
+        """
+        self.db.index["files"][fname]["chain"][self.db.get_at()] = self.snapshot_file(fname, self.db.get_at())
 
+        # remember the stat of what was recorded, so bulk updates can skip unchanged files without reading them
+        final_path = os.path.join(os.path.dirname(self.db.load_file), fname)
+        if os.path.exists(final_path):
+            st = os.stat(final_path)
+            self.db.index["files"][fname]["stat"] = [st.st_mtime_ns, st.st_size]
         self.db.write()
 
     def record_original(self, fname, addedin):
@@ -65,8 +139,10 @@ class FileMon:
         else:
             chain = {}
         if os.path.exists(os.path.join(os.path.dirname(self.db.load_file), fname)):
-            with self.open(hashname, "wb") as sink, self.open_local(fname, "rb") as source:
-                shutil.copyfileobj(source, sink)
+            with trace.span("filemon.record_original", file=fname):
+                with self.open(hashname, "wb") as sink, self.open_local(fname, "rb") as source:
+                    shutil.copyfileobj(source, sink)
+                    trace.count("bytes_local_written", source.tell())
         
             self.db.index["files"][fname] = {
                     "chain": chain,
@@ -95,10 +171,48 @@ class FileMon:
         else:
             hashname = self.db.index["files"][fname]["chain"][version]
 
-        if hashname is "":
-            os.remove(os.path.join(os.path.dirname(self.db.load_file), fname))
+        self.restore_hash(fname, hashname)
+
+    def restore_hash(self, fname, hashname):
+        """
+        Restore fname from a stored hash, or remove it if the hash is ""
+        """
+        if hashname == "":
+            if os.path.exists(os.path.join(os.path.dirname(self.db.load_file), fname)):
+                os.remove(os.path.join(os.path.dirname(self.db.load_file), fname))
         else:
-            with self.open(hashname, "rb") as source, self.open_local(fname, "wb") as sink:
-                shutil.copyfileobj(source, sink)
-        
+            with trace.span("filemon.restore", file=fname):
+                with self.open(hashname, "rb") as source, self.open_local(fname, "wb") as sink:
+                    shutil.copyfileobj(source, sink)
+                    trace.count("bytes_local_read", sink.tell())
+
+    def find_version(self, fname, version):
+        """
+        Find the stored hash of fname as it was right after script version ran, i.e. the one recorded by the newest script in its chain
+        at or before version.
+
+        Returns None if no script up to version touched fname.
+        """
+        chain = self.db.index["files"][fname]["chain"]
+        if version in chain:
+            return chain[version]
+
+        if version and version not in self.db.repo.positions:
+            # the repo index has not been loaded yet (or is out of date)
+            self.db.repo.update()
+        limit = self.db.repo.position(version)
+        found = [x for x in chain if x in self.db.repo.positions and self.db.repo.positions[x] <= limit]
+        if not found:
+            return None
+        return chain[max(found, key=self.db.repo.position)]
+
+    def restore_latest(self, fname, version):
+        """
+        Restore fname to the state it had right after script version ran. Falls back to the original if no script up to version touched it.
+        """
+        hashname = self.find_version(fname, version)
+        if hashname is None:
+            hashname = self.db.index["files"][fname]["original"]
+        self.restore_hash(fname, hashname)
+
 from .db import DotConfigFiles
@@ -2,7 +2,7 @@
 Contains functions to get hashed names for things
 """
 
-from hashlib import sha512
+from hashlib import sha256, sha512
 from ..auth import interpret_urlish
 
 def get_remote_hash(remote):
@@ -28,3 +28,16 @@ def get_file_hash(remotehash, filename, scripthash):
     m.update(filename.encode("utf-8"))
     m.update(scripthash.encode("utf-8"))
     return m.hexdigest()
+
+def get_content_hash(path):
+    """
+    Get the sha256 of a file's contents, used to check whether a file is in an expected state
+
+    :param path: path of the file
+    """
+
+    m = sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            m.update(chunk)
+    return m.hexdigest()
@@ -0,0 +1,67 @@
+"""
+Sync journal:
+
+a write-ahead log of how far each script in an in-progress sync got, so an interrupted sync can resume instead of starting over.
+
+Stored in the journal file in the .configfiles folder, as one json object per line:
+
+    {"script": "hash", "phase": "phase", ...}
+
+where phase is one of PHASES, in the order they happen:
+
+- originals: the originals of the script's files are recorded (and on disk)
+- downloaded: the script is downloaded to its script_ file
+- executed: the script ran successfully
+- recorded: the script's files are recorded, with "files" holding the {file: hash} to put in the chains
+
+Every entry is fsync-ed before log() returns, so an entry's presence guarantees the phase completed. The journal is removed once
+the sync finishes (or is rolled back, or the instance is desynced or rolled back).
+
+The first entry is {"script": "", "phase": "base", "at": at, "remote": remote hash}, the state the sync started from. The rest of the
+journal is only trusted if the instance is still on that remote and at has only moved forward from there (see DotConfigFiles._load_journal).
+"""
+
+import json
+import os
+
+PHASES = ["originals", "downloaded", "executed", "recorded"]
+
+class SyncJournal:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """
+        Read the journal, returning {script hash: latest entry}
+        """
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn write at the end of the journal; that phase never completed
+                    break
+                entries[entry["script"]] = entry
+        return entries
+
+    def log(self, script, phase, **extra):
+        entry = {"script": script, "phase": phase}
+        entry.update(extra)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def reached(entry, phase):
+    """
+    Has the journal entry (or None) reached phase?
+    """
+    return entry is not None and PHASES.index(entry["phase"]) >= PHASES.index(phase)
@@ -0,0 +1,270 @@
+"""
+Version pack:
+
+an optional single-file store for the versions otherwise kept as one .gz per version in the files/ folder, for hosts with long
+histories where that means tens of thousands of small files.
+
+Stored in the .configfiles folder as:
+
+- files.idx: the name of the current data file on the first line, then one "hash offset length" line per stored version, appended as
+  versions are stored. Later lines for the same hash win.
+- files.N.pack: the data file. Every stored version is appended to it as a gzip member (the same bytes as its .gz in files/ would be).
+
+The data file is read through mmap, so reading a version is a slice rather than an open/close. Nothing is modified in place: repack()
+writes the live versions (and any still in files/) to a new data file, switches the index over to it with a rename, and only then
+removes the old data file and the loose versions.
+
+The pack is used for all new versions once it exists, i.e. after the first repack.
+
+Several processes may use the same pack (e.g. watch running while a sync does), so appends and repacks hold an exclusive flock on
+files.lock, take the offset from the real end of the data file, and pick up the index lines other processes added (or the new
+index a repack switched to) first. Lookups that miss do the same before giving up.
+"""
+
+import gzip
+import io
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # no flock (windows): only one process can safely use a pack at a time
+    fcntl = None
+
+INDEX_NAME = "files.idx"
+LOCK_NAME = "files.lock"
+
+@contextmanager
+def locked(directory):
+    """
+    Hold the exclusive lock on the pack in directory, between processes
+    """
+    with open(os.path.join(directory, LOCK_NAME), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+class VersionPack:
+    def __init__(self, directory):
+        """
+        Open the existing pack in directory (the .configfiles folder)
+        """
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self.lock = threading.Lock()
+        self.map = None
+        self.mapped = 0
+        self.dirty = False
+        self.data = self.index = None
+
+        with locked(directory):
+            self._load()
+
+    def _load(self):
+        """
+        (Re)open the current index and data file. Needs the pack lock, as it may cut off a torn line.
+        """
+        self.close()
+        self.entries = {}
+
+        with open(self.index_path, "rb") as f:
+            content = f.read()
+        if not content.endswith(b"\n"):
+            # torn append at the end; that version was never flushed, drop it so the next append starts on a fresh line
+            content = content[:content.rfind(b"\n") + 1]
+            with open(self.index_path, "r+b") as f:
+                f.truncate(len(content))
+
+        lines = content.decode("utf-8").splitlines()
+        self.data_name = lines[0]
+        self._parse(lines[1:])
+        self.loaded = len(content)
+
+        self.data_path = os.path.join(self.directory, self.data_name)
+        self.data = open(self.data_path, "ab")
+        self.index = open(self.index_path, "a")
+
+    def _parse(self, lines):
+        for line in lines:
+            fhash, offset, length = line.split()
+            self.entries[fhash] = (int(offset), int(length))
+
+    def _refresh(self):
+        """
+        Pick up what other processes did since the index was loaded: reload everything if a repack switched to a new index,
+        otherwise read the lines appended to it (only whole ones, an append may be in progress without the lock)
+        """
+        if os.stat(self.index_path).st_ino != os.fstat(self.index.fileno()).st_ino:
+            self._load()
+            return
+
+        with open(self.index_path, "rb") as f:
+            f.seek(self.loaded)
+            content = f.read()
+        content = content[:content.rfind(b"\n") + 1]
+        self._parse(content.decode("utf-8").splitlines())
+        self.loaded += len(content)
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, INDEX_NAME))
+
+    def __contains__(self, fhash):
+        with self.lock:
+            if fhash not in self.entries:
+                self._refresh()
+            return fhash in self.entries
+
+    def _view(self, offset, length):
+        # the data file only grows, so the map only needs replacing once something past its end is read
+        if offset + length > self.mapped:
+            if self.map is not None:
+                self.map.close()
+            with open(self.data_path, "rb") as f:
+                self.mapped = os.fstat(f.fileno()).st_size
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    def read_raw(self, fhash):
+        """
+        The stored (gzipped) bytes of a version
+        """
+        with self.lock:
+            if fhash not in self.entries:
+                self._refresh()
+            try:
+                return self._view(*self.entries[fhash])
+            except FileNotFoundError:
+                # the data file was replaced by a repack in another process
+                with locked(self.directory):
+                    self._load()
+                return self._view(*self.entries[fhash])
+
+    def open(self, fhash, mode="rb"):
+        """
+        Open a version by its hash, like FileMon.open
+        """
+        if "r" in mode:
+            return io.BytesIO(gzip.decompress(self.read_raw(fhash)))
+        return _PackFile(self, fhash)
+
+    def add(self, fhash, data):
+        """
+        Append a version, already gzipped
+        """
+        with self.lock, locked(self.directory):
+            self._refresh()
+            # the real end of the file, other processes may have appended since this one last did
+            offset = os.fstat(self.data.fileno()).st_size
+            self.data.write(data)
+            self.data.flush()
+            line = "{} {} {}\n".format(fhash, offset, len(data))
+            self.index.write(line)
+            self.index.flush()
+            self.loaded += len(line.encode("utf-8"))
+            self.entries[fhash] = (offset, len(data))
+            self.dirty = True
+
+    def size(self):
+        return os.path.getsize(self.data_path)
+
+    def flush(self):
+        """
+        fsync the versions appended since the last flush
+        """
+        with self.lock:
+            if self.dirty:
+                os.fsync(self.data.fileno())
+                os.fsync(self.index.fileno())
+                self.dirty = False
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.mapped = 0
+        if self.data is not None:
+            self.data.close()
+            self.index.close()
+            self.data = self.index = None
+
+class _PackFile(io.BytesIO):
+    def __init__(self, pack, fhash):
+        super().__init__()
+        self.pack = pack
+        self.fhash = fhash
+
+    def close(self):
+        if not self.closed:
+            self.pack.add(self.fhash, gzip.compress(self.getvalue()))
+        super().close()
+
+def repack(directory):
+    """
+    Compact the pack in directory, creating it if there is none, and move the versions in files/ into it. Other processes using
+    the pack switch over to the new one on their next append (or lookup that misses).
+
+    Returns (number of versions, bytes used before, bytes used after)
+    """
+    loose_dir = os.path.join(directory, "files")
+    old = VersionPack(directory) if VersionPack.exists(directory) else None
+    with locked(directory):
+        if old:
+            # versions other processes appended since it was opened
+            old._refresh()
+        generation = int(old.data_name.split(".")[1]) + 1 if old else 1
+        data_name = "files.{}.pack".format(generation)
+
+        loose = [x for x in os.listdir(loose_dir) if x.endswith(".gz")]
+        before = old.size() if old else 0
+        lines = [data_name]
+        offset = 0
+
+        with open(os.path.join(directory, data_name), "wb") as out:
+            def append(fhash, data):
+                nonlocal offset
+                out.write(data)
+                lines.append("{} {} {}".format(fhash, offset, len(data)))
+                offset += len(data)
+
+            if old:
+                # keep the versions in the order they were stored
+                for fhash, _ in sorted(old.entries.items(), key=lambda x: x[1][0]):
+                    append(fhash, old.read_raw(fhash))
+            for name in loose:
+                path = os.path.join(loose_dir, name)
+                before += os.path.getsize(path)
+                if old and name[:-3] in old:
+                    continue
+                with open(path, "rb") as f:
+                    append(name[:-3], f.read())
+
+            out.flush()
+            os.fsync(out.fileno())
+
+        index_path = os.path.join(directory, INDEX_NAME)
+        with open(index_path + ".tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_path + ".tmp", index_path)
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        if old:
+            old.close()
+            os.remove(old.data_path)
+        for name in loose:
+            os.remove(os.path.join(loose_dir, name))
+
+        return len(lines) - 1, before, offset
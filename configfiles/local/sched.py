@@ -0,0 +1,101 @@
+"""
+Script scheduler:
+
+works out which scripts in a sync can run at the same time, based on the files each one declares.
+
+Two scripts depend on each other if they share a file, in which case the later one waits for the earlier one. Scripts that declare no
+files are treated as barriers: they wait for everything before them, and everything after them waits for them.
+"""
+
+import heapq
+
+class ScriptScheduler:
+    def __init__(self, scripts):
+        """
+        :param scripts: list of (script hash, script object) in chain order
+        """
+        self.order = [h for h, _ in scripts]
+        self.deps = {}
+        self.started = set()
+        self.done = set()
+        self.committed = 0
+
+        last_writer = {}
+        last_barrier = None
+        since_barrier = []
+
+        for h, so in scripts:
+            if not so["files"]:
+                deps = set(since_barrier)
+                last_writer = {}
+                since_barrier = []
+            else:
+                deps = {last_writer[x] for x in so["files"] if x in last_writer}
+                for x in so["files"]:
+                    last_writer[x] = h
+                since_barrier.append(h)
+            if last_barrier is not None:
+                deps.add(last_barrier)
+            if not so["files"]:
+                last_barrier = h
+            self.deps[h] = deps
+
+        # ready scripts are kept in a heap by chain position, and each script counts the dependencies it still waits for, so
+        # scheduling stays linear in the number of scripts
+        self.positions = {h: i for i, h in enumerate(self.order)}
+        self.waiting = {h: len(deps) for h, deps in self.deps.items()}
+        self.dependents = {h: [] for h in self.order}
+        for h in self.order:
+            for d in self.deps[h]:
+                self.dependents[d].append(h)
+        self.queue = [(self.positions[h], h) for h in self.order if not self.deps[h]]
+
+    def ready(self, limit=None):
+        """
+        Scripts that have not started and whose dependencies are all done, in chain order
+
+        :param limit: return at most this many
+        """
+        if limit is None:
+            limit = len(self.queue)
+        picked = []
+        while self.queue and len(picked) < limit:
+            entry = heapq.heappop(self.queue)
+            # started scripts are only dropped from the heap once they reach the top
+            if entry[1] not in self.started:
+                picked.append(entry)
+        for entry in picked:
+            heapq.heappush(self.queue, entry)
+        return [h for _, h in picked]
+
+    def start(self, h):
+        self.started.add(h)
+
+    def finish(self, h):
+        self.done.add(h)
+        for d in self.dependents[h]:
+            self.waiting[d] -= 1
+            if self.waiting[d] == 0:
+                heapq.heappush(self.queue, (self.positions[d], d))
+
+    def running(self):
+        return self.started - self.done
+
+    def advance(self):
+        """
+        Return the scripts that now extend the fully completed prefix of the chain, in order
+        """
+        newly = []
+        while self.committed < len(self.order) and self.order[self.committed] in self.done:
+            newly.append(self.order[self.committed])
+            self.committed += 1
+        return newly
+
+    def finished(self):
+        return self.committed == len(self.order)
+
+    def uncommitted_started(self):
+        """
+        Scripts that were started but are not part of the completed prefix (i.e. need undoing)
+        """
+        return [h for h in self.order[self.committed:] if h in self.started]
@@ -0,0 +1,276 @@
+"""
+Storage backends for repositories.
+
+A backend gives access to the files of one repository, with all paths relative to the repository root. The backend is picked by
+the scheme of the repository url:
+
+- sftp://[user@]host[:port]/path, or the classic [user@]host:path urlish: SFTP over ssh (paramiko)
+- file:///path/to/repo: a repo on a local (or network mounted) filesystem, using native file I/O
+- memory://name: an in-memory repo, shared by every backend opened with the same name in the process (for testing)
+
+Every backend implements:
+
+- open(path, mode): binary file object ("rb", "wb")
+- read(path) / write(path, data): whole-file helpers on top of open
+- listdir(path), mkdir(path), rmdir(path), remove(path)
+- rename(src, dst): replaces dst if it exists
+- stat(path): object with st_size and st_mtime; raises IOError if path does not exist
+- close()
+"""
+
+import io
+import os
+import threading
+from socket import create_connection
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+from paramiko.transport import Transport
+from ..auth import authenticate_transport, interpret_urlish
+from .. import trace
+
+def parse_url(url):
+    """
+    Split a repository url into (scheme, username, host, port, path). Missing parts are None.
+    """
+    if "://" not in url:
+        username, host, path = interpret_urlish(url)
+        return "sftp", username, host, None, path
+
+    parts = urlsplit(url)
+    if parts.scheme == "memory":
+        return "memory", None, parts.netloc, None, parts.path
+    return parts.scheme, parts.username, parts.hostname, parts.port, parts.path
+
+class Backend:
+    def open(self, path, mode="rb"):
+        raise NotImplementedError()
+
+    def read(self, path):
+        with self.open(path, "rb") as f:
+            return f.read()
+
+    def write(self, path, data):
+        with self.open(path, "wb") as f:
+            f.write(data)
+
+    def listdir(self, path):
+        raise NotImplementedError()
+
+    def mkdir(self, path):
+        raise NotImplementedError()
+
+    def rmdir(self, path):
+        raise NotImplementedError()
+
+    def remove(self, path):
+        raise NotImplementedError()
+
+    def rename(self, src, dst):
+        raise NotImplementedError()
+
+    def stat(self, path):
+        raise NotImplementedError()
+
+    def exists(self, path):
+        try:
+            self.stat(path)
+        except IOError:
+            return False
+        return True
+
+    def close(self):
+        pass
+
+class SFTPBackend(Backend):
+    def __init__(self, host, path, port=None, create=False):
+        with trace.span("repo.connect"):
+            self.socket = create_connection((host, port or 22))
+            self.transport = Transport(self.socket)
+            self.transport.start_client()
+        with trace.span("repo.auth"):
+            authenticate_transport(self.transport, "{}:{}".format(host, port or 22))
+        with trace.span("repo.open_sftp"):
+            self.client = self.transport.open_sftp_client()
+            if create:
+                try:
+                    self.client.stat(path)
+                except IOError:
+                    self.client.mkdir(path)
+                trace.count("round_trips")
+            if path:
+                self.client.chdir(path)
+                trace.count("round_trips")
+
+    def open(self, path, mode="rb"):
+        trace.count("round_trips", 2)
+        f = self.client.open(path, mode)
+        if "w" in mode:
+            # don't wait for each write to be acknowledged before sending the next
+            f.set_pipelined(True)
+        return f
+
+    def listdir(self, path):
+        trace.count("round_trips")
+        return self.client.listdir(path)
+
+    def mkdir(self, path):
+        trace.count("round_trips")
+        self.client.mkdir(path)
+
+    def rmdir(self, path):
+        trace.count("round_trips")
+        self.client.rmdir(path)
+
+    def remove(self, path):
+        trace.count("round_trips")
+        self.client.remove(path)
+
+    def rename(self, src, dst):
+        trace.count("round_trips")
+        try:
+            self.client.posix_rename(src, dst)
+        except IOError:
+            # server without the posix-rename extension; plain sftp rename refuses to overwrite
+            if self.exists(dst):
+                self.remove(dst)
+            self.client.rename(src, dst)
+
+    def stat(self, path):
+        trace.count("round_trips")
+        return self.client.stat(path)
+
+    def close(self):
+        self.client.close()
+        self.transport.close()
+        self.socket.close()
+
+class LocalBackend(Backend):
+    def __init__(self, root, create=False):
+        self.root = os.path.expanduser(root)
+        if create and not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        if not os.path.isdir(self.root):
+            raise IOError("no such repository directory: " + self.root)
+
+    def _path(self, path):
+        return os.path.join(self.root, path)
+
+    def open(self, path, mode="rb"):
+        return open(self._path(path), mode)
+
+    def listdir(self, path):
+        return os.listdir(self._path(path))
+
+    def mkdir(self, path):
+        os.mkdir(self._path(path))
+
+    def rmdir(self, path):
+        os.rmdir(self._path(path))
+
+    def remove(self, path):
+        os.remove(self._path(path))
+
+    def rename(self, src, dst):
+        os.replace(self._path(src), self._path(dst))
+
+    def stat(self, path):
+        return os.stat(self._path(path))
+
+class MemoryBackend(Backend):
+    stores = {}
+    stores_lock = threading.Lock()
+
+    def __init__(self, name, create=False):
+        with MemoryBackend.stores_lock:
+            if name not in MemoryBackend.stores:
+                if not create:
+                    raise IOError("no such in-memory repository: " + name)
+                MemoryBackend.stores[name] = ({}, {""}, threading.Lock())
+            self.files, self.dirs, self.lock = MemoryBackend.stores[name]
+
+    def _norm(self, path):
+        return os.path.normpath(path).strip("/") if path not in ("", ".") else ""
+
+    def open(self, path, mode="rb"):
+        path = self._norm(path)
+        if "r" in mode:
+            with self.lock:
+                if path not in self.files:
+                    raise IOError("no such file: " + path)
+                return io.BytesIO(self.files[path])
+        if os.path.dirname(path) not in self.dirs:
+            raise IOError("no such directory: " + os.path.dirname(path))
+        return _MemoryFile(self, path)
+
+    def listdir(self, path):
+        path = self._norm(path)
+        with self.lock:
+            if path not in self.dirs:
+                raise IOError("no such directory: " + path)
+            return [os.path.basename(x) for x in list(self.files) + list(self.dirs) if x and os.path.dirname(x) == path]
+
+    def mkdir(self, path):
+        path = self._norm(path)
+        with self.lock:
+            if path in self.dirs or path in self.files:
+                raise IOError("already exists: " + path)
+            if os.path.dirname(path) not in self.dirs:
+                raise IOError("no such directory: " + os.path.dirname(path))
+            self.dirs.add(path)
+
+    def rmdir(self, path):
+        path = self._norm(path)
+        with self.lock:
+            if path not in self.dirs:
+                raise IOError("no such directory: " + path)
+            if any(os.path.dirname(x) == path for x in list(self.files) + list(self.dirs) if x):
+                raise IOError("directory not empty: " + path)
+            self.dirs.remove(path)
+
+    def remove(self, path):
+        path = self._norm(path)
+        with self.lock:
+            if path not in self.files:
+                raise IOError("no such file: " + path)
+            del self.files[path]
+
+    def rename(self, src, dst):
+        src, dst = self._norm(src), self._norm(dst)
+        with self.lock:
+            if src not in self.files:
+                raise IOError("no such file: " + src)
+            self.files[dst] = self.files.pop(src)
+
+    def stat(self, path):
+        path = self._norm(path)
+        with self.lock:
+            if path in self.files:
+                return SimpleNamespace(st_size=len(self.files[path]), st_mtime=0)
+            if path in self.dirs:
+                return SimpleNamespace(st_size=0, st_mtime=0)
+        raise IOError("no such file: " + path)
+
+class _MemoryFile(io.BytesIO):
+    def __init__(self, backend, path):
+        super().__init__()
+        self.backend = backend
+        self.path = path
+
+    def close(self):
+        if not self.closed:
+            with self.backend.lock:
+                self.backend.files[self.path] = self.getvalue()
+        super().close()
+
+def open_backend(url, create=False):
+    """
+    Open the backend for a repository url. With create, the repository root is created if it does not exist.
+    """
+    scheme, _, host, port, path = parse_url(url)
+    if scheme == "sftp":
+        return SFTPBackend(host, path, port, create)
+    elif scheme == "file":
+        return LocalBackend(path, create)
+    elif scheme == "memory":
+        return MemoryBackend(host, create)
+    raise ValueError("unknown repository scheme " + scheme)
@@ -2,31 +2,22 @@
 Implements the locking functionality of repositories
 """
 
-from paramiko.transport import Transport
-from ..auth import authenticate_transport, interpret_urlish
-from socket import socket
+from .. import trace
 
 class RepoReadLock:
-    def __init__(self, url):
-        self.url = url
-        self.transport = None
-        self.client = None
-        self.socket = None
+    def __init__(self, repo):
+        self.repo = repo
         self.i = 0
 
     def __enter__(self):
-        self.socket = socket()
-        self.socket.connect((interpret_urlish(self.url)[1], 22))
-        self.transport = Transport(self.socket)
-        self.transport.start_client()
-        authenticate_transport(self.transport)
-        self.client = self.transport.open_sftp_client()
-        self.client.chdir(interpret_urlish(self.url)[2])
+        if not self.repo.opened:
+            self.repo.open()
 
-        self._lock()
+        with trace.span("lock.read.acquire"):
+            self._lock()
 
     def _lock(self):
-        target_locks = self.client.listdir("locks")
+        target_locks = self.repo.backend.listdir("locks")
         target_locks.sort()
 
         if "write_lock" in target_locks:
@@ -35,50 +26,54 @@ class RepoReadLock:
             self.i = 0
             while "read_lock_" + str(self.i) in target_locks:
                 self.i += 1
-            self.client.mkdir("locks/read_lock_" + str(self.i))
+            self.repo.backend.mkdir("locks/read_lock_" + str(self.i))
 
     def _unlock(self):
-        self.client.rmdir("locks/read_lock_" + str(self.i))
+        self.repo.backend.rmdir("locks/read_lock_" + str(self.i))
 
     def __exit__(self, *args):
-        self._unlock()
-
-        self.client.close()
-        self.transport.close()
-        self.socket.close()
+        with trace.span("lock.read.release"):
+            self._unlock()
 
 class RepoWriteLock:
-    def __init__(self, url):
-        self.url = url
-        self.transport = None
-        self.client = None
-        self.socket = socket()
+    def __init__(self, repo):
+        self.repo = repo
 
     def __enter__(self):
-        self.socket.connect((interpret_urlish(self.url)[1], 22))
-        self.transport = Transport(self.socket)
-        self.transport.start_client()
-        authenticate_transport(self.transport)
-        self.client = self.transport.open_sftp_client()
-        self.client.chdir(interpret_urlish(self.url)[2])
+        if self.repo.read_only:
+            raise RuntimeError("can't write to a read-only mirror")
+        if not self.repo.opened:
+            self.repo.open()
 
-        self._lock()
+        with trace.span("lock.write.acquire"):
+            self._lock()
 
     def _lock(self):
-        target_locks = self.client.listdir("locks")
+        target_locks = self.repo.backend.listdir("locks")
         target_locks.sort()
 
         if target_locks:
             raise RuntimeError("repo is locked; try again later")
         else:
-            self.client.mkdir("locks/write_lock")
+            self.repo.backend.mkdir("locks/write_lock")
 
     def _unlock(self):
-        self.client.rmdir("locks/write_lock")
+        self.repo.backend.rmdir("locks/write_lock")
 
     def __exit__(self, *args):
-        self._unlock()
+        with trace.span("lock.write.release"):
+            self._unlock()
+
+class NoLock:
+    """
+    Used instead of the read lock for read-only mirrors, which are updated atomically and have no lock directory to write to
+    """
+    def __init__(self, repo):
+        self.repo = repo
 
-        self.client.close()
-        self.transport.close()
-        self.socket.close()
+    def __enter__(self):
+        if not self.repo.opened:
+            self.repo.open()
+
+    def __exit__(self, *args):
+        pass
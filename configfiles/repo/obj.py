@@ -1,6 +1,8 @@
 """
 Contains the Repository class, the main way to interact with a configfiles repo
 
+Repositories are accessed through a storage backend picked by the url's scheme (see backends.py), SFTP by default.
+
 Internally, repositories are stored as a folder with the following structure
 
 (repo root)
@@ -8,14 +10,17 @@ Internally, repositories are stored as a folder with the following structure
 =- index.json
 =- scripts/
   =- (hash).py
-  =- (hash2).py
+  =- (hash2).py.gz  (gzipped, see compressed below)
   ...
+=- snapshots/
+  =- (script hash).tar.gz
 =- locks/
   =- write_lock
   =- read_lock_0  (auto incremented using listdir)
 
 index.json contains various information, such as script names and sources (often auto-generated)
 scripts/ contains all of the scripts, named by their sha1 hashes
+snapshots/ contains the full state of every tracked file right after a given script ran, used to bootstrap new machines
 locks/ contains the lockfiles.
 
 write_lock's presence indicates another configfiles instance is writing or modifying the repo and no reads nor changes should occur
@@ -29,6 +34,15 @@ The repository's index contains a few fields:
 - start: start of script objects
 - revision: increments with every additional script
 - end
+- snapshots: (optional) dictionary of script hash -> snapshot object
+- compression: (optional) "gzip" if new scripts should be stored gzipped. Clients that do not know this field still write plain scripts,
+  which is fine, but cannot read compressed ones, so it is only set on repos created with init --compress
+- mirror: (only in read-only mirrors) {"primary": url of the repo this mirrors, "time": when it was pushed}
+
+snapshot objects:
+
+- files: list of files stored in the snapshot tarball
+- deleted: list of files which do not exist at that point
 
 so:
 
@@ -36,45 +50,55 @@ so:
 - files: list of files modified by the script (filenames)
 - next: next script in chain
 - prev: previous script in chain
+- seq: position of the script in the chain, starting at 0 (missing in repos written by old versions, which are then walked instead)
+- post: (optional) sha256 of each file after the script ran; if they all match already the script need not run
+- compressed: (optional) true if the script is stored as scripts/(hash).py.gz
 """
 
-from socket import socket
-from paramiko.transport import Transport
-from .locks import RepoReadLock, RepoWriteLock
-from ..auth import authenticate_transport, interpret_urlish
+from .locks import RepoReadLock, RepoWriteLock, NoLock
+from .backends import open_backend
+from .. import trace
 from hashlib import sha512
 import json
+import os
+import time
+import uuid
+import zlib
+
+CHUNK_SIZE = 65536
+
+def script_path(hname, so):
+    """
+    Path of a script in the repo
+    """
+    return "scripts/" + hname + (".py.gz" if so.get("compressed") else ".py")
 
 class Repository:
-    def __init__(self, url):
+    def __init__(self, url, read_only=False):
+        """
+        :param read_only: the repo is a mirror; it is read without locking and cannot be written to
+        """
         self.url = url
         self.index = {}
+        self.read_only = read_only
+
+        # scripts in chain order, and the position of each in it; rebuilt whenever the index is loaded
+        self.order = []
+        self.positions = {}
 
-        self.read_lock = RepoReadLock(url)
-        self.write_lock = RepoWriteLock(url)
+        self.read_lock = NoLock(self) if read_only else RepoReadLock(self)
+        self.write_lock = RepoWriteLock(self)
 
-        self.client = None
-        self.transport = None
-        self.socket = socket()
+        self.backend = None
 
         self.opened = False
 
     def open(self):
         """
-        Opens the connection
+        Opens the connection (or whatever the url's backend needs)
         """
 
-        self.socket.connect((interpret_urlish(self.url)[1], 22))
-        self.transport = Transport(self.socket)
-        self.transport.start_client()
-        authenticate_transport(self.transport)
-        self.client = self.transport.open_sftp_client()
-        target_path = interpret_urlish(self.url)[2]
-        try:
-            self.client.stat(target_path)
-        except IOError:
-            self.client.mkdir(target_path)
-        self.client.chdir(target_path)
+        self.backend = open_backend(self.url, create=not self.read_only)
         self.opened = True
 
     def close(self):
@@ -84,9 +108,7 @@ class Repository:
 
         if not self.opened:
             return
-        self.client.close()
-        self.transport.close()
-        self.socket.close()
+        self.backend.close()
         self.opened = False
 
     def update(self):
@@ -100,8 +122,42 @@ class Repository:
             self.open()
 
         with self.read_lock:
-            with self.client.open("index.json") as f:
-                self.index = json.load(f)
+            self._load_index()
+
+    def _load_index(self):
+        """
+        Read the index and rebuild the positions, with a lock held
+        """
+        with trace.span("repo.index_download"):
+            data = self.backend.read("index.json")
+            self.index = json.loads(data.decode("utf-8"))
+            trace.count("bytes_down", len(data))
+        self._build_positions()
+
+    def _build_positions(self):
+        """
+        Build the position array from the scripts' seq numbers, falling back to walking the chain if they are missing or inconsistent
+        """
+        scripts = self.index.get("scripts", {})
+        order = [None] * len(scripts)
+        for hname, so in scripts.items():
+            seq = so.get("seq")
+            if seq is None or not 0 <= seq < len(order) or order[seq] is not None:
+                break
+            order[seq] = hname
+        else:
+            if not order or (order[0] == self.index["start"] and order[-1] == self.index["end"]):
+                self.order = order
+                self.positions = {h: i for i, h in enumerate(order)}
+                return
+
+        order = []
+        pos = self.index["start"]
+        while pos:
+            order.append(pos)
+            pos = scripts[pos]["next"]
+        self.order = order
+        self.positions = {h: i for i, h in enumerate(order)}
 
     def get_script(self, hname=None):
         """
@@ -112,22 +168,164 @@ class Repository:
         return self.index["scripts"][hname]
 
     def download_script(self, hname=None):
+        """
+        Download a script, decompressing it as it arrives if it is stored compressed. Raises RuntimeError if its content does not
+        match its hash.
+        """
         if hname is None:
             hname = self.index["start"]
+        so = self.get_script(hname)
         with self.read_lock:
-            with self.client.open("scripts/" + hname + ".py", "r") as f:
-                return f.read()
+            with trace.span("repo.script_download", script=hname):
+                parts = []
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if so.get("compressed") else None
+                with self.backend.open(script_path(hname, so), "rb") as f:
+                    while True:
+                        chunk = f.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        trace.count("bytes_down", len(chunk))
+                        parts.append(decompressor.decompress(chunk) if decompressor else chunk)
+                if decompressor:
+                    parts.append(decompressor.flush())
+                data = b"".join(parts)
+
+        h = sha512()
+        h.update(data.decode("utf-8").encode("utf-7"))
+        if h.hexdigest() != hname:
+            raise RuntimeError("script {} does not match its hash, the repo is corrupt".format(hname))
+        return data
 
     def get_revision(self):
         return self.index["revision"]
 
+    def position(self, hname):
+        """
+        Position of a script in the chain ("" is before the first script, so -1)
+        """
+        if hname == "":
+            return -1
+        return self.positions[hname]
+
+    def at_position(self, pos):
+        """
+        Script at a position in the chain ("" for before the first script)
+        """
+        if pos < 0:
+            return ""
+        return self.order[pos]
+
+    def distance(self, a, b):
+        """
+        Number of scripts from a to b (negative if b is before a)
+        """
+        return self.position(b) - self.position(a)
+
+    def seek(self, hname, count):
+        """
+        The script count scripts after (or before, if negative) hname, clamped to the chain
+        """
+        return self.at_position(min(max(self.position(hname) + count, -1), len(self.order) - 1))
+
+    def between(self, a, b):
+        """
+        The scripts after a up to and including b, in chain order
+        """
+        return self.order[self.position(a) + 1:self.position(b) + 1]
+
+    def latest_snapshot(self, before=None):
+        """
+        Find the newest snapshot at or before script before (default the end). Returns "" if there is none.
+        """
+        if before is None:
+            before = self.index["end"]
+        limit = self.position(before)
+        found = [self.positions[h] for h in self.index.get("snapshots", {}) if h in self.positions and self.positions[h] <= limit]
+        return self.order[max(found)] if found else ""
+
+    def download_snapshot(self, hname):
+        with self.read_lock:
+            with trace.span("repo.snapshot_download", script=hname):
+                data = self.backend.read("snapshots/" + hname + ".tar.gz")
+                trace.count("bytes_down", len(data))
+                return data
+
+    def add_snapshot(self, hname, data, files, deleted):
+        """
+        Store a snapshot (gzipped tarball of files) of the state right after script hname
+        """
+        with self.write_lock:
+            # don't write back an index missing what others appended since it was read
+            self._load_index()
+            if not self.backend.exists("snapshots"):
+                self.backend.mkdir("snapshots")
+
+            with trace.span("repo.snapshot_upload", script=hname):
+                self.backend.write("snapshots/" + hname + ".tar.gz", data)
+                trace.count("bytes_up", len(data))
+
+            self.index.setdefault("snapshots", {})[hname] = {
+                    "files": files,
+                    "deleted": deleted
+            }
+            self._write()
+
     def append_script(self, script_obj, script_contents):
+        """
+        Append a script to the chain
+
+        :param script_contents: the script, either as a string or as an iterable of string pieces. Pieces are hashed and uploaded (to
+            a temporary name, renamed to the hash once it is known) as they come, so a generated script is never held in memory whole.
+        """
+        if isinstance(script_contents, str):
+            script_contents = [script_contents]
+        compressed = self.index.get("compression") == "gzip"
+        temp_path = "scripts/upload_{}.tmp".format(uuid.uuid4().hex)
+
         h = sha512()
-        h.update(script_contents.encode("utf-7"))
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compressed else None
+        try:
+            with trace.span("repo.script_upload"):
+                with self.backend.open(temp_path, "wb") as f:
+                    def put(data):
+                        if compressor:
+                            data = compressor.compress(data)
+                        f.write(data)
+                        trace.count("bytes_up", len(data))
+
+                    pending = ""
+                    for piece in script_contents:
+                        pending += piece
+                        # utf-7 encodes a run of non-direct characters differently if it is split, so only hash up to a newline
+                        # (always encoded directly), which gives the same bytes as encoding the whole script at once
+                        cut = pending.rfind("\n") + 1
+                        if cut:
+                            h.update(pending[:cut].encode("utf-7"))
+                            put(pending[:cut].encode("utf-8"))
+                            pending = pending[cut:]
+                    h.update(pending.encode("utf-7"))
+                    put(pending.encode("utf-8"))
+                    if compressor:
+                        data = compressor.flush()
+                        f.write(data)
+                        trace.count("bytes_up", len(data))
+        except BaseException:
+            if self.backend.exists(temp_path):
+                self.backend.remove(temp_path)
+            raise
+
         hname = h.hexdigest()
-        script_obj["prev"] = self.index["end"]
 
         with self.write_lock:
+            # others may have appended while the script was uploading, link it onto the current end
+            self._load_index()
+            script_obj["prev"] = self.index["end"]
+
+            # fill in the seq numbers of repos written by older versions
+            for i, x in enumerate(self.order):
+                self.index["scripts"][x]["seq"] = i
+            script_obj["seq"] = len(self.order)
+
             self.index["revision"] += 1
             if self.index["end"]: self.index["scripts"][self.index["end"]]["next"] = hname
             self.index["end"] = hname
@@ -135,14 +333,64 @@ class Repository:
 
             if self.index["start"] == "":
                 self.index["start"] = hname
+            if compressed:
+                script_obj["compressed"] = True
+            self.order.append(hname)
+            self.positions[hname] = script_obj["seq"]
 
+            # the script is in place before the index refers to it
+            self.backend.rename(temp_path, script_path(hname, script_obj))
             self._write()
-            with self.client.open("scripts/" + hname + ".py", "w") as f:
-                f.write(script_contents)
+
+    def mirror(self, url):
+        """
+        Push a consistent copy of the repo (index.json, scripts/ and snapshots/) to a read-only mirror at url. Returns the revision pushed.
+
+        Scripts and snapshots are named by their hash and never change, so only the ones missing from the mirror are copied, each
+        renamed into place once fully written. The index goes last, also under a temporary name renamed over the old one, so the
+        mirror never has an index referring to missing scripts.
+        """
+        with self.read_lock:
+            index = json.loads(self.backend.read("index.json").decode("utf-8"))
+            target = open_backend(url, create=True)
+            try:
+                for d in ("locks", "scripts", "snapshots"):
+                    if not target.exists(d):
+                        target.mkdir(d)
+
+                with trace.span("mirror.copy", mirror=url):
+                    # files are written under a temporary name and renamed once complete, so an interrupted push never leaves a
+                    # truncated file under its final name (which later pushes would take as already copied)
+                    present = set(target.listdir("scripts"))
+                    for hname, so in index["scripts"].items():
+                        path = script_path(hname, so)
+                        if os.path.basename(path) not in present:
+                            target.write(path + ".tmp", self.backend.read(path))
+                            target.rename(path + ".tmp", path)
+
+                    present = set(target.listdir("snapshots"))
+                    for hname in index.get("snapshots", {}):
+                        path = "snapshots/" + hname + ".tar.gz"
+                        if hname + ".tar.gz" not in present:
+                            target.write(path + ".tmp", self.backend.read(path))
+                            target.rename(path + ".tmp", path)
+
+                index["mirror"] = {
+                        "primary": self.url,
+                        "time": time.time()
+                }
+                target.write("index.json.tmp", json.dumps(index).encode("utf-8"))
+                target.rename("index.json.tmp", "index.json")
+            finally:
+                target.close()
+
+        return index["revision"]
 
     def _write(self):
-        with self.client.open("index.json", "w") as f:
-            json.dump(self.index, f)
+        with trace.span("repo.index_upload"):
+            data = json.dumps(self.index).encode("utf-8")
+            self.backend.write("index.json", data)
+            trace.count("bytes_up", len(data))
 
     def write(self):
         with self.write_lock:
@@ -154,19 +402,21 @@ class Repository:
     def iterate_from(self, pos):
         return FollowChainIterator(self, pos)
 
-    def new(self):
+    def new(self, compress=False):
+        """
+        Create an empty repo
+
+        :param compress: store scripts gzipped (see compression above)
+        """
         if not self.opened:
             self.open()
 
-        try:
-            self.client.stat("index.json")
+        if self.backend.exists("index.json"):
             raise RuntimeError("already init-ed, manually delete the folder to re-init")
-        except IOError:
-            pass
 
         # create the skeleton fs
-        self.client.mkdir("locks")
-        self.client.mkdir("scripts")
+        self.backend.mkdir("locks")
+        self.backend.mkdir("scripts")
 
         # create a basic index.json
         self.index = {
@@ -176,6 +426,10 @@ class Repository:
                 "end": "",
                 "scripts": {}
         }
+        if compress:
+            self.index["compression"] = "gzip"
+        self.order = []
+        self.positions = {}
 
         self.write()
 
@@ -184,14 +438,13 @@ class Repository:
 class FollowChainIterator:
     def __init__(self, repo, start):
         self.repo = repo
-        self.pos = start
+        self.pos = repo.positions[start] if start else len(repo.order)
 
     def __next__(self):
-        if not self.pos:
+        if self.pos >= len(self.repo.order):
             raise StopIteration
-        n = self.pos
-        result = self.repo.get_script(self.pos)
-        self.pos = result["next"]
+        n = self.repo.order[self.pos]
+        self.pos += 1
         return n
 
     def __iter__(self):
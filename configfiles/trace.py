@@ -0,0 +1,103 @@
+"""
+Lightweight span tracing, used to find out where the time in a sync goes.
+
+Disabled by default, in which case span() and count() do (almost) nothing. When enabled (through --profile or --trace-file) every
+span is recorded with its start time, duration and thread, and counters accumulate things like round trips and bytes transferred.
+
+The trace can be written as either a plain json document:
+
+    {
+        "spans": [{"name": ..., "start": (seconds), "duration": (seconds), "thread": ..., "args": {...}}, ...],
+        "counters": {"name": value}
+    }
+
+or in the chrome trace event format (loadable in chrome://tracing or perfetto)
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+enabled = False
+
+spans = []
+counters = {}
+
+_lock = threading.Lock()
+_epoch = time.perf_counter()
+
+def enable():
+    global enabled, _epoch
+    enabled = True
+    _epoch = time.perf_counter()
+
+@contextmanager
+def span(name, **args):
+    """
+    Time the enclosed block as a span called name. Keyword arguments are stored with the span.
+    """
+    if not enabled:
+        yield
+        return
+
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        with _lock:
+            spans.append({
+                "name": name,
+                "start": begin - _epoch,
+                "duration": end - begin,
+                "thread": threading.get_ident(),
+                "args": args
+            })
+
+def count(name, amount=1):
+    """
+    Add amount to the counter name
+    """
+    if not enabled:
+        return
+    with _lock:
+        counters[name] = counters.get(name, 0) + amount
+
+def summary():
+    """
+    Return a list of (name, calls, total seconds) sorted by total time
+    """
+    totals = {}
+    with _lock:
+        for s in spans:
+            calls, total = totals.get(s["name"], (0, 0.0))
+            totals[s["name"]] = (calls + 1, total + s["duration"])
+    return sorted(((k, v[0], v[1]) for k, v in totals.items()), key=lambda x: x[2], reverse=True)
+
+def write_trace(path, fmt="json"):
+    """
+    Write the collected trace to path, either as "json" or "chrome"
+    """
+    with _lock:
+        if fmt == "chrome":
+            pid = os.getpid()
+            events = [{
+                "name": s["name"],
+                "ph": "X",
+                "ts": s["start"] * 1e6,
+                "dur": s["duration"] * 1e6,
+                "pid": pid,
+                "tid": s["thread"],
+                "args": s["args"]
+            } for s in spans]
+            end = max((s["start"] + s["duration"] for s in spans), default=0)
+            for name, value in counters.items():
+                events.append({"name": name, "ph": "C", "ts": end * 1e6, "pid": pid, "args": {name: value}})
+            data = {"traceEvents": events, "displayTimeUnit": "ms"}
+        else:
+            data = {"spans": spans, "counters": counters}
+
+        with open(path, "w") as f:
+            json.dump(data, f)
@@ -0,0 +1,181 @@
+"""
+Watch mode:
+
+watches the tracked files of a configfiles instance and checks in changes to them as update scripts.
+
+Changes are batched: a batch is checked in once no tracked file has changed for a while (the debounce), or once changes have been
+pending for too long, so an editor saving with lots of small writes results in one script.
+
+On linux, inotify (through ctypes) is used to watch the directories containing the tracked files (so editors that save by renaming
+a new file over the old one are still seen); elsewhere, or if inotify is not available, the files are periodically stat-ed.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+import click
+from .gen import patcher
+
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_Q_OVERFLOW  = 0x00004000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+class InotifyWatcher:
+    def __init__(self, paths):
+        """
+        :param paths: absolute paths of the files to watch
+        """
+        self.paths = set(paths)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.dirs = {}
+        for d in {os.path.dirname(x) for x in self.paths}:
+            if not os.path.isdir(d):
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed on " + d)
+            self.dirs[wd] = d
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for changes, returning the set of watched paths that changed
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        data = os.read(self.fd, 65536)
+        changed = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+            name = data[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + length].rstrip(b"\0")
+            pos += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, so anything could have changed
+                return set(self.paths)
+            if wd in self.dirs:
+                path = os.path.join(self.dirs[wd], os.fsdecode(name))
+                if path in self.paths:
+                    changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    def __init__(self, paths, interval=1.0):
+        self.paths = set(paths)
+        self.interval = interval
+        self.state = {x: self._stat(x) for x in self.paths}
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        changed = set()
+        for x in self.paths:
+            st = self._stat(x)
+            if st != self.state[x]:
+                self.state[x] = st
+                changed.add(x)
+        return changed
+
+    def close(self):
+        pass
+
+def make_watcher(paths, polling=False):
+    if not polling:
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):
+            click.echo("inotify unavailable, falling back to polling")
+    return PollingWatcher(paths)
+
+def watch(db, debounce=2.0, max_delay=30.0, name=None, polling=False):
+    """
+    Watch the tracked files of db until interrupted, checking in batches of changes as update scripts.
+
+    The repo connection in db is kept open across batches. A batch that fails to check in is kept and retried.
+    """
+    home_dir = os.path.dirname(db.load_file)
+    tracked = {os.path.join(home_dir, x): x for x in db.index["files"]}
+    watcher = make_watcher(tracked, polling)
+    click.echo("watching {} files".format(len(tracked)))
+
+    pending = set()
+    first_change = last_change = 0
+
+    try:
+        while True:
+            if pending:
+                timeout = max(0, min(last_change + debounce, first_change + max_delay) - time.time())
+            else:
+                timeout = max_delay
+
+            changed = watcher.wait(timeout)
+            now = time.time()
+            if changed:
+                if not pending:
+                    first_change = now
+                last_change = now
+                pending |= {tracked[x] for x in changed}
+
+            if pending and (now - last_change >= debounce or now - first_change >= max_delay):
+                try:
+                    check_in(db, pending, name)
+                except Exception as e:
+                    # e.g. the repo is locked by another host, or the connection dropped: keep the batch and retry it after
+                    # another debounce
+                    click.echo("failed to check in {}: {}, retrying".format(", ".join(sorted(pending)), e))
+                    first_change = last_change = now
+                else:
+                    pending = set()
+    except KeyboardInterrupt:
+        if pending:
+            check_in(db, pending, name)
+    finally:
+        watcher.close()
+
+def check_in(db, files, name=None):
+    """
+    Check in the files that actually differ from their recorded version as one update script
+    """
+    changed = []
+    for f in sorted(files):
+        if not os.path.exists(os.path.join(os.path.dirname(db.load_file), f)):
+            click.echo("{} was removed, not checking it in".format(f))
+            continue
+        with db.filemon.open_version(f, "rb") as recorded, db.filemon.open_local(f, "rb") as current:
+            if recorded.read() != current.read():
+                changed.append(f)
+
+    if not changed:
+        return
+
+    # filled in as the script is generated, from the same reads of the files
+    post = {}
+    script_text = patcher.stream_template_update(db, changed, post=post)
+    db.append(script_text, name or "update {0}".format(", ".join(changed)), changed, post=post)
+    click.echo("checked in " + ", ".join(changed))
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+import uuid
+import pytest
+from configfiles.repo import Repository
+from configfiles.local import DotConfigFiles
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def remote():
+    """
+    url of a new, empty in-memory repo
+    """
+    url = "memory://" + uuid.uuid4().hex
+    repo = Repository(url)
+    repo.open()
+    repo.new()
+    repo.close()
+    return url
+
+@pytest.fixture
+def make_home(tmp_path, remote):
+    """
+    make_home(name, **files) creates a home directory with files in it, and returns a db for it synced to remote (or just set up to
+    sync to it, with sync=False)
+    """
+    def make(name, sync=True, **files):
+        home = tmp_path / name
+        home.mkdir()
+        for fname, content in files.items():
+            (home / fname).write_text(content)
+        db = DotConfigFiles(str(home / ".configfiles"), remote=remote)
+        if sync:
+            db.sync()
+        return db
+    return make
+
+def home_of(db):
+    return os.path.dirname(db.load_file)
+
+def read(db, fname):
+    with open(os.path.join(home_of(db), fname)) as f:
+        return f.read()
+
+def write(db, fname, content):
+    with open(os.path.join(home_of(db), fname), "w") as f:
+        f.write(content)
+
+def reopen(db):
+    """
+    A fresh db for the same home, as a new invocation would have
+    """
+    db.close()
+    return DotConfigFiles(db.load_file)
+
+def append_custom(db, name, code, files):
+    """
+    Append a hand-written script (code run in the home directory) to db's repo
+    """
+    db.append(code, name, files)
+
+def cli(cwd, *args):
+    """
+    Run python -m configfiles with args in cwd, returning the CompletedProcess (stdout and stderr together in stdout)
+    """
+    env = dict(os.environ, PYTHONPATH=PACKAGE)
+    return subprocess.run([sys.executable, "-m", "configfiles"] + list(args), cwd=str(cwd), env=env,
+                          stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, timeout=60)
@@ -0,0 +1,107 @@
+import json
+import pytest
+from paramiko.ssh_exception import AuthenticationException, BadAuthenticationType, SSHException
+from configfiles import auth
+
+class FakeKey:
+    def __init__(self, name):
+        self.name = name
+
+    def get_fingerprint(self):
+        return self.name.encode()
+
+class FakeTransport:
+    """
+    Accepts the methods (and keys, by name) in accept, and disconnects after max_tries failed attempts like sshd
+    """
+    def __init__(self, accept, max_tries=6):
+        self.accept = accept
+        self.max_tries = max_tries
+        self.attempts = []
+        self.authenticated = False
+
+    def _attempt(self, what):
+        if len([x for x in self.attempts if x not in self.accept]) >= self.max_tries:
+            raise SSHException("No existing session")
+        self.attempts.append(what)
+        if what not in self.accept:
+            raise AuthenticationException("denied")
+        self.authenticated = True
+
+    def auth_password(self, username, password):
+        self._attempt("password")
+
+    def auth_publickey(self, username, key):
+        self._attempt(key.name)
+
+    def auth_interactive(self, username, handler):
+        if "interactive" not in self.accept and "password" in self.accept:
+            raise BadAuthenticationType("not allowed", ["password"])
+        self._attempt("interactive")
+
+    def is_authenticated(self):
+        return self.authenticated
+
+@pytest.fixture
+def keys(monkeypatch, tmp_path):
+    """
+    keys(agent names, key file names) sets up the keys auth finds
+    """
+    monkeypatch.setattr(auth, "guessed_username", "me")
+    monkeypatch.setattr(auth, "guessed_password", "")
+    monkeypatch.setattr(auth, "use_interactive", True)
+    monkeypatch.setattr(auth, "auth_cache_path", str(tmp_path / "auth.json"))
+    monkeypatch.setattr(auth.getpass, "getpass", lambda prompt="": "typed")
+
+    def setup(agent, files):
+        monkeypatch.setattr(auth, "agent_keys", lambda: [FakeKey(x) for x in agent])
+        monkeypatch.setattr(auth, "file_keys", lambda: [FakeKey(x) for x in files])
+    return setup
+
+def planned(host="host"):
+    return [(method, bytes.fromhex(fingerprint).decode()) for method, fingerprint, _ in auth.plan_authentication(host)]
+
+def test_keys_are_offered_once(keys):
+    keys(["a", "b"], ["b", "c"])
+    assert planned() == [("agent", "a"), ("agent", "b"), ("keyfile", "c"), ("interactive", "")]
+
+def test_keys_are_capped(keys, monkeypatch):
+    keys(["a", "b", "c", "d", "e"], ["f", "g"])
+    monkeypatch.setattr(auth, "guessed_password", "secret")
+    assert planned() == [("password", ""), ("agent", "a"), ("agent", "b"), ("agent", "c"), ("interactive", "")]
+
+def test_interactive_is_reached_with_many_keys(keys):
+    keys(["a", "b", "c", "d", "e", "f", "g"], ["a", "h", "i"])
+    transport = FakeTransport({"interactive"})
+    auth.authenticate_transport(transport, "host")
+    assert transport.attempts[-1] == "interactive"
+
+def test_password_fallback_of_interactive(keys):
+    keys(["a"], [])
+    transport = FakeTransport({"password"})
+    auth.authenticate_transport(transport, "host")
+    assert transport.attempts == ["a", "password"]
+    assert auth.guessed_password == "typed"
+
+def test_what_worked_is_tried_first(keys, tmp_path):
+    keys(["a", "b", "c", "d", "e"], [])
+    auth.remember_auth("me@host", "keyfile", "e".encode().hex())
+    # the cached key is found even though it is past the limit, and in the agent rather than its file now
+    assert planned()[0] == ("agent", "e")
+    assert len([x for x in planned() if x[0] == "agent"]) == auth.MAX_KEY_ATTEMPTS + 1
+
+    transport = FakeTransport({"b"})
+    auth.authenticate_transport(transport, "host")
+    assert transport.attempts == ["e", "a", "b"]
+    assert json.loads((tmp_path / "auth.json").read_text())["me@host"] == {"method": "agent", "fingerprint": "b".encode().hex()}
+
+    transport = FakeTransport({"b"})
+    auth.authenticate_transport(transport, "host")
+    assert transport.attempts == ["b"]
+    assert planned("other")[0] == ("agent", "a")
+
+def test_nothing_works(keys, monkeypatch):
+    keys(["a"], [])
+    monkeypatch.setattr(auth, "use_interactive", False)
+    with pytest.raises(AuthenticationException):
+        auth.authenticate_transport(FakeTransport(set()), "host")
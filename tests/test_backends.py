@@ -0,0 +1,48 @@
+import uuid
+import pytest
+from configfiles.repo.backends import LocalBackend, MemoryBackend, open_backend, parse_url
+
+@pytest.fixture(params=["file", "memory"])
+def backend(request, tmp_path):
+    if request.param == "file":
+        return open_backend("file://" + str(tmp_path / "repo"), create=True)
+    return open_backend("memory://" + uuid.uuid4().hex, create=True)
+
+def test_parse_url():
+    assert parse_url("file:///srv/repo") == ("file", None, None, None, "/srv/repo")
+    assert parse_url("memory://test") == ("memory", None, "test", None, "")
+    assert parse_url("sftp://me@host:2222/repo") == ("sftp", "me", "host", 2222, "/repo")
+    assert parse_url("me@host:repo")[:3] == ("sftp", "me", "host")
+
+def test_open_backend_types(tmp_path):
+    assert isinstance(open_backend("file://" + str(tmp_path), create=True), LocalBackend)
+    assert isinstance(open_backend("memory://" + uuid.uuid4().hex, create=True), MemoryBackend)
+    with pytest.raises(IOError):
+        open_backend("memory://" + uuid.uuid4().hex)
+    with pytest.raises(ValueError):
+        open_backend("ftp://host/repo")
+
+def test_backend_files(backend):
+    backend.mkdir("scripts")
+    backend.write("scripts/a", b"one")
+    assert backend.read("scripts/a") == b"one"
+    assert backend.listdir("scripts") == ["a"]
+    assert backend.stat("scripts/a").st_size == 3
+
+    backend.write("scripts/b", b"two")
+    backend.rename("scripts/b", "scripts/a")
+    assert backend.read("scripts/a") == b"two"
+    assert not backend.exists("scripts/b")
+
+    with pytest.raises(IOError):
+        backend.rmdir("scripts")
+    backend.remove("scripts/a")
+    backend.rmdir("scripts")
+    assert not backend.exists("scripts")
+    with pytest.raises(IOError):
+        backend.read("scripts/a")
+
+def test_memory_stores_are_shared_by_name():
+    name = uuid.uuid4().hex
+    MemoryBackend(name, create=True).write("index.json", b"{}")
+    assert MemoryBackend(name).read("index.json") == b"{}"
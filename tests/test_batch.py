@@ -0,0 +1,55 @@
+import os
+from configfiles.local import DotConfigFiles, sync_many
+from conftest import append_custom, cli
+
+def homes(tmp_path, *names):
+    for name in names:
+        (tmp_path / name).mkdir()
+    return [str(tmp_path / name) for name in names]
+
+def test_sync_many(make_home, remote, tmp_path):
+    author = make_home("author", **{"a.conf": ""})
+    append_custom(author, "A", "open('a.conf', 'w').write('a\\n')\n", ["a.conf"])
+
+    results = sync_many(homes(tmp_path, "h1", "h2", "h3"), remote, parallel=2)
+    assert results == {str(tmp_path / h): None for h in ("h1", "h2", "h3")}
+    for h in ("h1", "h2", "h3"):
+        assert (tmp_path / h / "a.conf").read_text() == "a\n"
+        assert DotConfigFiles(str(tmp_path / h / ".configfiles")).get_at() == author.get_at()
+
+def test_sync_many_reports_failed_scripts(make_home, remote, tmp_path):
+    author = make_home("author", **{"a.conf": ""})
+    append_custom(author, "A", "open('a.conf', 'w').write('a\\n')\n", ["a.conf"])
+    append_custom(author, "fail", "open('a.conf', 'w').write('broken\n')\nraise SystemExit(1)\n", ["a.conf"])
+
+    results = sync_many(homes(tmp_path, "h1", "h2"), remote)
+    assert all(isinstance(e, RuntimeError) for e in results.values()), results
+    for h in ("h1", "h2"):
+        assert (tmp_path / h / "a.conf").read_text() == "a\n"
+        assert DotConfigFiles(str(tmp_path / h / ".configfiles"), remote=remote).get_at() != author.get_at()
+
+def test_sync_many_isolates_homes(make_home, remote, tmp_path):
+    author = make_home("author", **{"a.conf": ""})
+    append_custom(author, "A", "open('a.conf', 'w').write('a\\n')\n", ["a.conf"])
+    other = make_home("other")
+    other.index["at"] = "elsewhere"
+    other.index["remote"] = "memory://elsewhere"
+    other.close()
+
+    ok, = homes(tmp_path, "h1")
+    results = sync_many([ok, str(tmp_path / "other")], remote)
+    assert results[ok] is None
+    assert isinstance(results[str(tmp_path / "other")], RuntimeError)
+
+def test_sync_many_cli_exit_status(tmp_path):
+    remote = "file://" + str(tmp_path / "repo")
+    cli(tmp_path, "init", remote)
+    (tmp_path / "author").mkdir()
+    cli(tmp_path, "--local", "author", "sync", remote)
+    (tmp_path / "author" / "a.conf").write_text("")
+    (tmp_path / "fail.py").write_text("raise SystemExit(1)\n")
+    cli(tmp_path / "author", "--local", ".", "add", "-n", "fail", "../fail.py", "a.conf")
+
+    result = cli(tmp_path, "sync-many", "-r", remote, *homes(tmp_path, "h1", "h2"))
+    assert result.returncode != 0
+    assert "synced 0 of 2 homes" in result.stdout
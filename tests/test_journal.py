@@ -0,0 +1,81 @@
+import pytest
+from configfiles.local.journal import SyncJournal, reached
+from conftest import read, append_custom, cli
+
+# appends a line to log, so running it twice shows
+LOG_X = "open('log', 'a').write('X\\n')\n"
+# kills the sync running it the first time, as if the machine went down
+KILL_ONCE = "import os, signal\nif os.path.exists('../kill'):\n    os.remove('../kill')\n    os.kill(os.getppid(), signal.SIGKILL)\n"
+
+@pytest.fixture
+def interrupted(tmp_path):
+    """
+    home2 killed while syncing K, right after X (which writes log) ran
+    """
+    remote = "file://" + str(tmp_path / "repo")
+    cli(tmp_path, "init", remote)
+    for home in ("home1", "home2"):
+        (tmp_path / home).mkdir()
+        cli(tmp_path, "--local", home, "sync", remote)
+
+    (tmp_path / "x.py").write_text(LOG_X)
+    (tmp_path / "k.py").write_text(KILL_ONCE)
+    (tmp_path / "home1" / "log").write_text("X\n")
+    # add takes paths relative to where it is ran
+    cli(tmp_path / "home1", "--local", ".", "add", "-n", "X", "../x.py", "log")
+    cli(tmp_path / "home1", "--local", ".", "add", "-n", "K", "../k.py")
+
+    (tmp_path / "kill").write_text("")
+    assert cli(tmp_path, "--local", "home2", "sync", "--no-ff", remote).returncode != 0
+    assert (tmp_path / "home2" / ".configfiles" / "journal").exists()
+    assert (tmp_path / "home2" / "log").read_text() == "X\n"
+    return remote
+
+def test_journal_torn_line(tmp_path):
+    journal = SyncJournal(str(tmp_path / "journal"))
+    journal.log("a", "originals")
+    journal.log("a", "downloaded")
+    journal.log("b", "recorded", files={"x": "h"})
+    with open(journal.path, "a") as f:
+        f.write('{"script": "c", "pha')
+
+    entries = journal.load()
+    assert sorted(entries) == ["a", "b"]
+    assert reached(entries["a"], "originals") and not reached(entries["a"], "executed")
+    assert entries["b"]["files"] == {"x": "h"}
+    assert not reached(None, "originals")
+
+    journal.clear()
+    assert journal.load() == {}
+
+def test_interrupted_sync_resumes(tmp_path, interrupted):
+    result = cli(tmp_path, "--local", "home2", "sync", "--no-ff", interrupted)
+    assert result.returncode == 0, result.stdout
+    assert "resuming K" in result.stdout
+    assert "running X" not in result.stdout
+    assert (tmp_path / "home2" / "log").read_text() == "X\n"
+    assert not (tmp_path / "home2" / ".configfiles" / "journal").exists()
+
+def test_desync_discards_the_journal(tmp_path, interrupted):
+    assert cli(tmp_path, "--local", "home2", "desync").returncode == 0
+    assert not (tmp_path / "home2" / ".configfiles" / "journal").exists()
+
+    result = cli(tmp_path, "--local", "home2", "sync", "--no-ff", interrupted)
+    assert result.returncode == 0, result.stdout
+    assert "resuming" not in result.stdout
+    assert (tmp_path / "home2" / "log").read_text() == "X\n"
+
+def test_journal_of_another_remote_is_ignored(make_home):
+    db1 = make_home("home1")
+    db2 = make_home("home2")
+    append_custom(db1, "X", LOG_X, ["log"])
+    db2.repo.update()
+    h = db2.repo.index["end"]
+
+    # left over from an interrupted sync against some other repo
+    db2.journal.log("", "base", at="", remote="another")
+    db2.journal.log(h, "recorded", files={"log": "bogus"})
+
+    db2.sync(fastforward=False)
+    assert read(db2, "log") == "X\n"
+    assert db2.index["files"]["log"]["chain"][h] != "bogus"
@@ -0,0 +1,147 @@
+import gzip
+import multiprocessing
+import os
+from configfiles.local import DotConfigFiles
+from configfiles.local.pack import VersionPack, repack
+
+def make_store(tmp_path, **versions):
+    """
+    A .configfiles folder with loose versions in files/
+    """
+    (tmp_path / "files").mkdir()
+    for fhash, content in versions.items():
+        (tmp_path / "files" / (fhash + ".gz")).write_bytes(gzip.compress(content))
+    return str(tmp_path)
+
+def read(pack, fhash):
+    with pack.open(fhash) as f:
+        return f.read()
+
+def test_repack_moves_loose_versions(tmp_path):
+    directory = make_store(tmp_path, a=b"one", b=b"two")
+    assert not VersionPack.exists(directory)
+
+    versions, _, _ = repack(directory)
+    assert versions == 2
+    assert os.listdir(os.path.join(directory, "files")) == []
+
+    pack = VersionPack(directory)
+    assert read(pack, "a") == b"one"
+    assert read(pack, "b") == b"two"
+    pack.close()
+
+def test_appends_are_readable_and_latest_wins(tmp_path):
+    directory = make_store(tmp_path, a=b"one")
+    repack(directory)
+
+    pack = VersionPack(directory)
+    with pack.open("b", "wb") as f:
+        f.write(b"two")
+    with pack.open("a", "wb") as f:
+        f.write(b"three")
+    assert read(pack, "b") == b"two"
+    assert read(pack, "a") == b"three"
+    pack.flush()
+    pack.close()
+
+    pack = VersionPack(directory)
+    assert read(pack, "a") == b"three"
+    pack.close()
+
+def test_repack_drops_superseded_versions(tmp_path):
+    directory = make_store(tmp_path, a=b"one" * 100)
+    repack(directory)
+
+    pack = VersionPack(directory)
+    with pack.open("a", "wb") as f:
+        f.write(b"new")
+    before = pack.size()
+    pack.close()
+
+    versions, _, after = repack(directory)
+    assert versions == 1
+    assert after < before
+
+    pack = VersionPack(directory)
+    assert pack.data_name == "files.2.pack"
+    assert read(pack, "a") == b"new"
+    assert not os.path.exists(os.path.join(directory, "files.1.pack"))
+    pack.close()
+
+def test_torn_index_line_is_dropped(tmp_path):
+    directory = make_store(tmp_path, a=b"one")
+    repack(directory)
+    with open(os.path.join(directory, "files.idx"), "a") as f:
+        f.write("b 12")
+
+    pack = VersionPack(directory)
+    assert "b" not in pack
+    with pack.open("c", "wb") as f:
+        f.write(b"three")
+    pack.close()
+
+    pack = VersionPack(directory)
+    assert read(pack, "a") == b"one"
+    assert read(pack, "c") == b"three"
+    pack.close()
+
+def test_two_writers(tmp_path):
+    directory = make_store(tmp_path, a=b"one")
+    repack(directory)
+    first = VersionPack(directory)
+    second = VersionPack(directory)
+
+    with first.open("b", "wb") as f:
+        f.write(b"two")
+    with second.open("c", "wb") as f:
+        f.write(b"three")
+    # each sees what the other appended
+    assert read(first, "c") == b"three"
+    assert "b" in second and read(second, "b") == b"two"
+
+    # and keeps appending after the other repacked
+    second.close()
+    repack(directory)
+    with first.open("d", "wb") as f:
+        f.write(b"four")
+    first.close()
+
+    pack = VersionPack(directory)
+    assert pack.data_name == "files.2.pack"
+    assert [read(pack, x) for x in "abcd"] == [b"one", b"two", b"three", b"four"]
+    pack.close()
+
+def write_versions(directory, prefix, count):
+    pack = VersionPack(directory)
+    for i in range(count):
+        with pack.open("{}{}".format(prefix, i), "wb") as f:
+            f.write("{} {}".format(prefix, i).encode() * 50)
+    pack.close()
+
+def test_concurrent_processes(tmp_path):
+    directory = make_store(tmp_path)
+    repack(directory)
+
+    workers = [multiprocessing.Process(target=write_versions, args=(directory, prefix, 200)) for prefix in "xy"]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+        assert p.exitcode == 0
+
+    pack = VersionPack(directory)
+    for prefix in "xy":
+        for i in range(200):
+            assert read(pack, "{}{}".format(prefix, i)) == "{} {}".format(prefix, i).encode() * 50
+    pack.close()
+
+def test_repacked_under_a_running_instance(make_home):
+    db = make_home("home", **{"a.conf": "a\n"})
+    db.append("open('a.conf', 'w').write('a\\n')\n", "add", ["a.conf"])
+    other = DotConfigFiles(db.load_file)
+
+    # e.g. a repack while watch is running
+    other.filemon.repack()
+    with db.filemon.open_version("a.conf", "rb") as f:
+        assert f.read() == b"a\n"
+    other.close()
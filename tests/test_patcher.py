@@ -0,0 +1,72 @@
+import subprocess
+import sys
+import pytest
+from configfiles.gen import patcher
+from conftest import read, write
+
+ORIGINAL = "".join("line {}\n".format(i % 3) for i in range(30))
+CHANGED = ORIGINAL.replace("line 1\n", "line one\n", 4) + "end\n"
+
+@pytest.fixture
+def update_script(make_home, tmp_path):
+    """
+    An update script turning a.conf from ORIGINAL into CHANGED
+    """
+    db = make_home("home", **{"a.conf": ORIGINAL})
+    db.append(patcher.create_template_write(db, ["a.conf"]), "add", ["a.conf"])
+    write(db, "a.conf", CHANGED)
+
+    script = patcher.create_template_update(db, ["a.conf"])
+    (tmp_path / "update.py").write_text(script)
+    return str(tmp_path / "update.py")
+
+def run(script, directory, content):
+    directory.mkdir(exist_ok=True)
+    (directory / "a.conf").write_text(content)
+    result = subprocess.run([sys.executable, script], cwd=str(directory), stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return result.stdout, (directory / "a.conf").read_text()
+
+def test_make_patch_entry():
+    f, pre, post, delta, patch = patcher.make_patch_entry("a.conf", ORIGINAL.encode(), CHANGED.encode())
+    assert f == "a.conf"
+    assert len(pre) == len(post) == 64 and pre != post
+    assert patcher.diff_match_patch.diff_text2(patcher.diff_match_patch.diff_fromDelta(ORIGINAL, delta)) == CHANGED
+    assert patch
+
+def test_splice_on_exact_original(update_script, tmp_path):
+    out, content = run(update_script, tmp_path / "exact", ORIGINAL)
+    assert content == CHANGED
+    assert "Updated a.conf" in out
+
+def test_patch_on_drifted_file(update_script, tmp_path):
+    out, content = run(update_script, tmp_path / "drifted", "header\n" + ORIGINAL)
+    assert content == "header\n" + CHANGED
+    assert "Updated a.conf" in out
+
+def test_already_up_to_date(update_script, tmp_path):
+    out, content = run(update_script, tmp_path / "done", CHANGED)
+    assert content == CHANGED
+    assert "Already up to date a.conf" in out
+
+def test_sync_skips_applied_scripts(make_home, capsys):
+    db1 = make_home("home1", **{"a.conf": CHANGED})
+    db2 = make_home("home2", **{"a.conf": CHANGED})
+    db3 = make_home("home3", **{"a.conf": ORIGINAL})
+    post = {}
+    db1.append(patcher.stream_template_write(db1, ["a.conf"], post), "add", ["a.conf"], post=post)
+    capsys.readouterr()
+
+    db2.sync()
+    out = capsys.readouterr().out
+    assert "already applied add" in out
+    assert "running add" not in out
+    assert read(db2, "a.conf") == CHANGED
+    assert db1.get_at() in db2.index["files"]["a.conf"]["chain"]
+
+    db3.sync()
+    assert "running add" in capsys.readouterr().out
+    assert read(db3, "a.conf") == CHANGED
+
+def test_make_patch_entry_is_quiet(capsys):
+    patcher.make_patch_entry("a.conf", ORIGINAL.encode(), CHANGED.encode())
+    assert capsys.readouterr().out == ""
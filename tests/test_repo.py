@@ -0,0 +1,120 @@
+import json
+from hashlib import sha512
+from unittest import mock
+import pytest
+from configfiles.repo import Repository
+from configfiles.repo.backends import LocalBackend
+
+TRICKY = "a+b ~\\ é€ 😀\n+- '\"\n\n"
+
+def new_repo(url, compress=False):
+    repo = Repository(url)
+    repo.open()
+    repo.new(compress)
+    return repo
+
+def append(repo, name, pieces):
+    repo.append_script({"name": name, "files": [], "next": ""}, pieces)
+    return repo.index["end"]
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_streamed_script_hash_matches_whole(remote, compress):
+    repo = new_repo(remote + "_" + str(compress), compress)
+    text = TRICKY * 50
+    # split inside runs of characters utf-7 encodes, and between lines
+    pieces = [text[i:i + 7] for i in range(0, len(text), 7)]
+
+    h = append(repo, "tricky", pieces)
+    assert h == sha512(text.encode("utf-7")).hexdigest()
+    assert repo.download_script(h).decode("utf-8") == text
+    assert repo.get_script(h).get("compressed", False) == compress
+    assert not [x for x in repo.backend.listdir("scripts") if x.endswith(".tmp")]
+
+def test_compressed_scripts(remote):
+    repo = new_repo(remote + "_gz", True)
+    h = append(repo, "one", "print(1)\n" * 100)
+
+    assert repo.index["compression"] == "gzip"
+    assert repo.backend.listdir("scripts") == [h + ".py.gz"]
+    assert repo.download_script(h) == b"print(1)\n" * 100
+
+def test_corrupt_script_is_rejected(remote):
+    repo = Repository(remote)
+    repo.update()
+    h = append(repo, "one", "print(1)\n")
+    repo.backend.write("scripts/" + h + ".py", b"print(2)\n")
+
+    with pytest.raises(RuntimeError):
+        repo.download_script(h)
+
+def test_positions(remote):
+    repo = Repository(remote)
+    repo.update()
+    hashes = [append(repo, str(i), "print({})\n".format(i)) for i in range(5)]
+
+    assert [repo.get_script(h)["seq"] for h in hashes] == list(range(5))
+    assert repo.seek("", 2) == hashes[1]
+    assert repo.seek(hashes[3], -10) == ""
+    assert repo.seek(hashes[3], 10) == hashes[4]
+    assert repo.distance(hashes[1], hashes[4]) == 3
+    assert repo.between(hashes[1], hashes[3]) == hashes[2:4]
+    assert list(repo.iterate_from(hashes[2])) == hashes[2:]
+
+def test_positions_without_seq(remote):
+    repo = Repository(remote)
+    repo.update()
+    hashes = [append(repo, str(i), "print({})\n".format(i)) for i in range(3)]
+
+    # as written by an older version
+    for h in hashes:
+        del repo.index["scripts"][h]["seq"]
+    repo.write()
+
+    old = Repository(remote)
+    old.update()
+    assert old.order == hashes
+    h = append(old, "3", "print(3)\n")
+    assert [old.get_script(x)["seq"] for x in hashes + [h]] == list(range(4))
+
+def test_interrupted_mirror_push_is_redone(tmp_path):
+    repo = new_repo("file://" + str(tmp_path / "repo"))
+    h = append(repo, "one", "print(1)\n" * 100)
+    mirror_url = "file://" + str(tmp_path / "mirror")
+
+    real_write = LocalBackend.write
+    def interrupted_write(self, path, data):
+        if path.startswith("scripts/"):
+            real_write(self, path, data[:10])
+            raise IOError("connection lost")
+        real_write(self, path, data)
+
+    with mock.patch.object(LocalBackend, "write", interrupted_write):
+        with pytest.raises(IOError):
+            repo.mirror(mirror_url)
+    repo.mirror(mirror_url)
+
+    mirror = Repository(mirror_url, read_only=True)
+    mirror.update()
+    assert mirror.download_script(h) == b"print(1)\n" * 100
+    assert json.loads((tmp_path / "mirror" / "index.json").read_text())["mirror"]["primary"] == repo.url
+
+def test_append_while_another_appends(remote):
+    repo = Repository(remote)
+    repo.update()
+    first = append(repo, "first", "print(1)\n")
+
+    def pieces():
+        yield "print(2)\n"
+        # another client appends while this script is still being uploaded
+        other = Repository(remote)
+        other.update()
+        append(other, "other", "print(3)\n")
+        yield "print(4)\n"
+
+    mine = append(repo, "mine", pieces())
+    repo.update()
+    other = repo.order[1]
+    assert repo.order == [first, other, mine]
+    assert repo.get_script(mine)["prev"] == other
+    assert repo.get_script(other)["next"] == mine
+    assert [repo.get_script(h)["seq"] for h in repo.order] == [0, 1, 2]
@@ -0,0 +1,59 @@
+from configfiles.local.sched import ScriptScheduler
+
+def so(*files):
+    return {"files": list(files)}
+
+def test_disjoint_scripts_run_together():
+    sched = ScriptScheduler([("a", so("x")), ("b", so("y")), ("c", so("x"))])
+    assert sched.ready() == ["a", "b"]
+
+    sched.start("a")
+    sched.start("b")
+    assert sched.ready() == []
+
+    sched.finish("a")
+    assert sched.ready() == ["c"]
+
+def test_barrier_waits_for_everything():
+    sched = ScriptScheduler([("a", so("x")), ("custom", so()), ("b", so("y"))])
+    assert sched.ready() == ["a"]
+
+    sched.start("a")
+    sched.finish("a")
+    assert sched.ready() == ["custom"]
+
+    sched.start("custom")
+    sched.finish("custom")
+    assert sched.ready() == ["b"]
+
+def test_advance_only_over_completed_prefix():
+    sched = ScriptScheduler([("a", so("x")), ("b", so("y")), ("c", so("z"))])
+    for h in ("a", "b", "c"):
+        sched.start(h)
+
+    sched.finish("b")
+    assert sched.advance() == []
+    assert sched.uncommitted_started() == ["a", "b", "c"]
+
+    sched.finish("a")
+    assert sched.advance() == ["a", "b"]
+    assert not sched.finished()
+    assert sched.uncommitted_started() == ["c"]
+
+    sched.finish("c")
+    assert sched.advance() == ["c"]
+    assert sched.finished()
+
+def test_ready_limit_in_chain_order():
+    scripts = [(str(i), so("f{}".format(i % 100))) for i in range(5000)]
+    sched = ScriptScheduler(scripts)
+    assert sched.ready(3) == ["0", "1", "2"]
+
+    ran = []
+    while not sched.finished():
+        for h in sched.ready(1):
+            sched.start(h)
+            sched.finish(h)
+            ran.append(h)
+        sched.advance()
+    assert ran == [h for h, _ in scripts]
@@ -0,0 +1,197 @@
+import os
+import pytest
+from configfiles.gen import patcher, scan
+from configfiles.local.hashes import get_content_hash
+from configfiles import watch
+from configfiles.watch import check_in
+from conftest import home_of, read, write, reopen, append_custom
+
+def track(db, *files):
+    db.append(patcher.create_template_write(db, list(files)), "add", list(files))
+
+def test_scan_fresh_instance(make_home):
+    db = make_home("home", **{"a.conf": "a\n", "b.conf": "b\n"})
+    track(db, "a.conf")
+    track(db, "b.conf")
+    # a new invocation, which has not loaded the repo yet, and is past the last script touching a.conf
+    db = reopen(db)
+
+    write(db, "a.conf", "a changed\n")
+    write(db, "new.conf", "new\n")
+    with open(os.path.join(home_of(db), "blob.bin"), "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n\xff\xfe")
+
+    assert scan.scan(db, home_of(db)) == (["new.conf"], ["a.conf"])
+    db.close()
+
+def test_walk_skips(tmp_path):
+    (tmp_path / ".configfiles" / "files").mkdir(parents=True)
+    (tmp_path / ".configfiles" / "files" / "x.gz").write_text("")
+    (tmp_path / "cache").mkdir()
+    (tmp_path / "cache" / "y").write_text("")
+    (tmp_path / "z.conf").write_text("")
+
+    found = scan.walk(str(tmp_path), exclude=["cache"], skip=[str(tmp_path / ".configfiles")])
+    assert [os.path.basename(x) for x in found] == ["z.conf"]
+
+def test_is_text(tmp_path):
+    (tmp_path / "text").write_text("é" * scan.CHUNK_SIZE)
+    (tmp_path / "binary").write_bytes(b"ok\xff")
+    assert scan.is_text(str(tmp_path / "text"))
+    assert not scan.is_text(str(tmp_path / "binary"))
+    assert not scan.is_text(str(tmp_path / "missing"))
+
+def test_check_in_fresh_instance(make_home):
+    db = make_home("home", **{"a.conf": "a\n", "b.conf": "b\n"})
+    track(db, "a.conf")
+    track(db, "b.conf")
+    db = reopen(db)
+
+    write(db, "a.conf", "a\nmore\n")
+    check_in(db, {"a.conf", "b.conf"})
+    assert db.repo.get_script(db.repo.index["end"])["files"] == ["a.conf"]
+    db.close()
+
+def test_update_post_hashes(make_home):
+    files = {"{}.conf".format(i): "line {}\n".format(i) * 20 for i in range(5)}
+    db1 = make_home("home1", **files)
+    db2 = make_home("home2")
+    track(db1, *files)
+    for i, f in enumerate(sorted(files)):
+        write(db1, f, files[f].replace("line", "changed", i))
+    write(db1, "new.conf", "new\n")
+
+    post = {}
+    db1.append(patcher.stream_template_combined(db1, ["new.conf"], sorted(files), 2, post), "update", ["new.conf"] + sorted(files), post=post)
+
+    so = db1.repo.get_script(db1.repo.index["end"])
+    assert so["post"] == {f: get_content_hash(os.path.join(home_of(db1), f)) for f in so["files"]}
+
+    db2.sync()
+    for f in so["files"]:
+        assert read(db2, f) == read(db1, f)
+
+@pytest.fixture
+def sparse(make_home):
+    """
+    An instance synced with --only 'a*' past S1 (writing b) and S2 (writing a and b)
+    """
+    db1 = make_home("home1", **{"a.txt": "", "b.txt": ""})
+    db2 = make_home("home2")
+    append_custom(db1, "S1", "open('b.txt', 'w').write('S1\\n')\n", ["b.txt"])
+    append_custom(db1, "S2", "open('a.txt', 'w').write('S2\\n')\nopen('b.txt', 'w').write('S2\\n')\n", ["a.txt", "b.txt"])
+
+    db2.sync(fastforward=False, only=["a*"])
+    assert read(db2, "a.txt") == "S2\n"
+    assert db2.index["skipped"]
+    return db2
+
+def test_sparse_replay_keeps_chain_order(sparse):
+    sparse.sync(only=[])
+    assert read(sparse, "a.txt") == "S2\n"
+    assert read(sparse, "b.txt") == "S2\n"
+    assert not sparse.index["skipped"]
+
+def test_snapshot_refused_when_sparse(sparse):
+    with pytest.raises(RuntimeError):
+        sparse.snapshot()
+    assert not sparse.repo.index.get("snapshots")
+
+    sparse.sync(only=[])
+    sparse.snapshot()
+    assert sparse.repo.index["snapshots"]
+
+# scripts note that they ran outside the home directory
+S1 = "open('../ran', 'a').write('S1\\n')\nopen('a.txt', 'w').write('1\\n')\n"
+CUSTOM = "open('../ran', 'a').write('C\\n')\n"
+S2 = "open('../ran', 'a').write('S2\\n')\nopen('a.txt', 'w').write('2\\n')\nopen('b.txt', 'w').write('b\\n')\n"
+
+@pytest.fixture
+def snapshotted(make_home, tmp_path):
+    """
+    A repo with S1, a custom script and S2, snapshotted after S2 by an instance that ran them
+    """
+    author = make_home("author", **{"a.txt": "", "b.txt": ""})
+    append_custom(author, "S1", S1, ["a.txt"])
+    append_custom(author, "C", CUSTOM, [])
+    append_custom(author, "S2", S2, ["a.txt", "b.txt"])
+
+    full = make_home("full")
+    assert (tmp_path / "ran").read_text() == "S1\nC\nS2\n"
+    (tmp_path / "ran").unlink()
+    full.snapshot()
+    assert full.repo.latest_snapshot() == full.get_at()
+    return full
+
+def test_snapshot_restore(snapshotted, make_home, tmp_path):
+    db2 = make_home("home2", **{"a.txt": "mine\n"})
+    assert not (tmp_path / "ran").exists()
+    assert read(db2, "a.txt") == "2\n"
+    assert read(db2, "b.txt") == "b\n"
+    assert db2.get_at() == snapshotted.get_at()
+
+    append_custom(snapshotted, "S3", "open('../ran', 'a').write('S3\\n')\nopen('b.txt', 'w').write('3\\n')\n", ["b.txt"])
+    db2.sync()
+    assert (tmp_path / "ran").read_text() == "S3\n"
+    assert read(db2, "b.txt") == "3\n"
+
+    db2.desync()
+    assert read(db2, "a.txt") == "mine\n"
+    assert not os.path.exists(os.path.join(home_of(db2), "b.txt"))
+
+def test_snapshot_restore_replaying_custom(snapshotted, make_home, tmp_path):
+    db2 = make_home("home2", sync=False)
+    db2.sync(replay_custom=True)
+    assert (tmp_path / "ran").read_text() == "C\n"
+    assert read(db2, "a.txt") == "2\n"
+
+def test_sync_without_snapshot(snapshotted, make_home, tmp_path):
+    db2 = make_home("home2", sync=False)
+    db2.sync(use_snapshot=False)
+    assert (tmp_path / "ran").read_text() == "S1\nC\nS2\n"
+    assert read(db2, "b.txt") == "b\n"
+
+class FakeWatcher:
+    """
+    Reports the changes in events one wait at a time (calling the callables in between), then acts as if interrupted
+    """
+    def __init__(self, events):
+        self.events = list(events)
+
+    def wait(self, timeout):
+        if not self.events:
+            raise KeyboardInterrupt()
+        event = self.events.pop(0)
+        if callable(event):
+            event()
+            return []
+        return event
+
+    def close(self):
+        pass
+
+def test_watch_retries_failed_check_ins(make_home, monkeypatch):
+    db = make_home("home", **{"a.conf": "a\n"})
+    track(db, "a.conf")
+    end = db.repo.index["end"]
+
+    # another host holding a read lock makes the check-in fail
+    db.repo.backend.mkdir("locks/read_lock_0")
+    write(db, "a.conf", "a\nmore\n")
+    path = os.path.join(home_of(db), "a.conf")
+    monkeypatch.setattr(watch, "make_watcher", lambda paths, polling: FakeWatcher([[path], lambda: db.repo.backend.rmdir("locks/read_lock_0"), []]))
+
+    watch.watch(db, debounce=0, max_delay=0)
+    so = db.repo.get_script(db.repo.index["end"])
+    assert so["prev"] == end
+    assert so["files"] == ["a.conf"]
+
+def test_snapshot_keeps_concurrent_appends(snapshotted, make_home):
+    author = make_home("author2")
+    snapshotted.repo.update()
+    # appended while the snapshot is being packed
+    append_custom(author, "S3", "pass\n", [])
+    snapshotted.repo.add_snapshot(snapshotted.get_at(), b"", [], [])
+
+    snapshotted.repo.update()
+    assert snapshotted.repo.get_script(snapshotted.repo.index["end"])["name"] == "S3"
@@ -0,0 +1,58 @@
+import json
+import pytest
+from configfiles import trace
+from conftest import cli
+
+@pytest.fixture
+def tracing(monkeypatch):
+    monkeypatch.setattr(trace, "enabled", False)
+    monkeypatch.setattr(trace, "spans", [])
+    monkeypatch.setattr(trace, "counters", {})
+    return trace
+
+def test_disabled_records_nothing(tracing):
+    with tracing.span("sync"):
+        tracing.count("scripts_run")
+    assert tracing.spans == []
+    assert tracing.counters == {}
+
+def test_spans_and_counters(tracing, tmp_path):
+    tracing.enable()
+    with tracing.span("sync"):
+        for i in range(3):
+            with tracing.span("sync.execute", script=str(i)):
+                tracing.count("scripts_run")
+    tracing.count("bytes_downloaded", 100)
+
+    assert [(name, calls) for name, calls, _ in tracing.summary()] == [("sync", 1), ("sync.execute", 3)]
+    assert tracing.counters == {"scripts_run": 3, "bytes_downloaded": 100}
+    assert tracing.spans[0]["args"] == {"script": "0"}
+
+    tracing.write_trace(str(tmp_path / "trace.json"))
+    data = json.loads((tmp_path / "trace.json").read_text())
+    assert len(data["spans"]) == 4 and data["counters"]["scripts_run"] == 3
+
+    tracing.write_trace(str(tmp_path / "chrome.json"), "chrome")
+    events = json.loads((tmp_path / "chrome.json").read_text())["traceEvents"]
+    assert sorted(e["ph"] for e in events) == ["C", "C", "X", "X", "X", "X"]
+
+def test_profile_and_trace_file(tmp_path):
+    remote = "file://" + str(tmp_path / "repo")
+    cli(tmp_path, "init", remote)
+    for home in ("home1", "home2"):
+        (tmp_path / home).mkdir()
+        cli(tmp_path, "--local", home, "sync", remote)
+    (tmp_path / "home1" / "a.txt").write_text("a\n")
+    cli(tmp_path / "home1", "--local", ".", "update", "a.txt")
+
+    result = cli(tmp_path, "--local", "home2", "--profile", "--trace-file", "trace.json", "--trace-format", "chrome", "sync", remote)
+    assert result.returncode == 0, result.stdout
+    assert (tmp_path / "home2" / "a.txt").read_text() == "a\n"
+
+    lines = result.stdout.splitlines()
+    header = lines.index(next(x for x in lines if x.startswith("phase")))
+    assert any(x.split()[0] == "sync" for x in lines[header + 1:])
+    assert any(x.split() == ["scripts_run", "1"] for x in lines[header + 1:])
+
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert "sync.execute" in {e["name"] for e in events}